@@ -1,27 +1,120 @@
+import argparse
+import asyncio
 import csv
+import logging
 import os
-from datetime import datetime
+import queue
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from metrics import ANALYTICS_ROLLUP_DROPPED, ANALYTICS_WRITE_SECONDS
 
 # Путь к файлу CSV
 CSV_FILE = "analytics.csv"
+# Журнал событий: строки только дописываются в конец, раз в COMPACT_INTERVAL сворачиваются в CSV
+EVENTS_FILE = "analytics_events.log"
+# Как часто фоновая задача сбрасывает накопленные события на диск (сек)
+FLUSH_INTERVAL = float(os.getenv("ANALYTICS_FLUSH_INTERVAL", "1.0"))
+# Как часто журнал событий сворачивается в CSV (сек)
+COMPACT_INTERVAL = float(os.getenv("ANALYTICS_COMPACT_INTERVAL", "300"))
+# Через сколько секунд повторять пачку, которую не удалось записать (сек)
+WRITE_RETRY_DELAY = float(os.getenv("ANALYTICS_RETRY_DELAY", "5"))
+# Сколько событий ждут повторной записи в дневные сводки; сверх этого самые старые отбрасываются
+ROLLUP_BACKLOG = int(os.getenv("ANALYTICS_ROLLUP_BACKLOG", "50000"))
+
+CSV_HEADER = [
+    "Имя пользователя",
+    "Логин",
+    "Нажатия /start",
+    "Сгенерированные прогнозы",
+    "Оплаты",
+    "Время использования (мин)",
+    "Последнее обновление"
+]
+
+# Хранилище аналитики: "csv" (журнал событий + CSV) или "sqlite"
+ANALYTICS_BACKEND = os.getenv("ANALYTICS_BACKEND", "csv")
+# Путь к базе SQLite
+SQLITE_FILE = os.getenv("ANALYTICS_DB", "analytics.db")
+
+SQLITE_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS analytics ("
+    "username TEXT, "
+    "user_id TEXT NOT NULL, "
+    "start_count INTEGER NOT NULL DEFAULT 0, "
+    "forecast_count INTEGER NOT NULL DEFAULT 0, "
+    "payment_count INTEGER NOT NULL DEFAULT 0, "
+    "usage_time REAL NOT NULL DEFAULT 0, "
+    "last_updated TEXT)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS analytics_user_id ON analytics (user_id)",
+)
+# Счётчики из события прибавляются к уже накопленным значениям
+SQLITE_UPSERT = (
+    "INSERT INTO analytics VALUES (?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (user_id) DO UPDATE SET "
+    "username = excluded.username, "
+    "start_count = start_count + excluded.start_count, "
+    "forecast_count = forecast_count + excluded.forecast_count, "
+    "payment_count = payment_count + excluded.payment_count, "
+    "usage_time = usage_time + excluded.usage_time, "
+    "last_updated = excluded.last_updated"
+)
+
+# Дневные сводки: счётчики воронки и активные пользователи за каждый день.
+# Хранятся в SQLite при любом ANALYTICS_BACKEND и обновляются при каждой записи событий,
+# поэтому /stats читает по строке на день вместо всей истории.
+ROLLUP_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS analytics_daily ("
+    "day TEXT PRIMARY KEY, "
+    "active_users INTEGER NOT NULL DEFAULT 0, "
+    "start_count INTEGER NOT NULL DEFAULT 0, "
+    "forecast_count INTEGER NOT NULL DEFAULT 0, "
+    "invoice_count INTEGER NOT NULL DEFAULT 0, "
+    "payment_count INTEGER NOT NULL DEFAULT 0, "
+    "usage_time REAL NOT NULL DEFAULT 0)",
+    "CREATE TABLE IF NOT EXISTS analytics_daily_users ("
+    "day TEXT NOT NULL, user_id TEXT NOT NULL, PRIMARY KEY (day, user_id)) WITHOUT ROWID",
+)
+ROLLUP_UPSERT = (
+    "INSERT INTO analytics_daily VALUES (?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (day) DO UPDATE SET "
+    "active_users = active_users + excluded.active_users, "
+    "start_count = start_count + excluded.start_count, "
+    "forecast_count = forecast_count + excluded.forecast_count, "
+    "invoice_count = invoice_count + excluded.invoice_count, "
+    "payment_count = payment_count + excluded.payment_count, "
+    "usage_time = usage_time + excluded.usage_time"
+)
+# Сколько последних дней помнить user_id для подсчёта уникальных активных пользователей
+ROLLUP_USER_DAYS = int(os.getenv("ANALYTICS_ROLLUP_USER_DAYS", "2"))
+
+_TAG_RE = re.compile(r"<[^>]+>")
+
+# Агрегаты по пользователям в памяти: {user_id: [username, start, forecast, payment, usage, last_updated]}
+_aggregates = {}
+_event_queue = None
+_writer_task = None
+_sqlite_queue = None
+_sqlite_thread = None
 
 # Инициализация CSV-файла с заголовками, если он не существует
 def init_csv():
     if not os.path.exists(CSV_FILE):
         with open(CSV_FILE, mode="w", newline="", encoding="utf-8") as file:
             writer = csv.writer(file)
-            writer.writerow([
-                "Имя пользователя",
-                "Логин",
-                "Нажатия /start",
-                "Сгенерированные прогнозы",
-                "Оплаты",
-                "Время использования (мин)",
-                "Последнее обновление"
-            ])
+            writer.writerow(CSV_HEADER)
 
-# Чтение данных из CSV
+# Чтение данных аналитики (в формате CSV с заголовком)
 def read_analytics_data():
+    if ANALYTICS_BACKEND == "sqlite":
+        return [CSV_HEADER] + read_sqlite_data()
+    return read_csv_data()
+
+# Чтение данных из CSV
+def read_csv_data():
     init_csv()
     data = []
     with open(CSV_FILE, mode="r", newline="", encoding="utf-8") as file:
@@ -31,7 +124,7 @@ def read_analytics_data():
 
 # Запись или обновление данных в CSV
 def update_analytics_data(username, user_id, start_count=0, forecast_count=0, payment_count=0, usage_time=0):
-    data = read_analytics_data()
+    data = read_csv_data()
     
     # Проверяем, есть ли пользователь в таблице
     user_row = None
@@ -76,3 +169,467 @@ def update_analytics_data(username, user_id, start_count=0, forecast_count=0, pa
     with open(CSV_FILE, mode="w", newline="", encoding="utf-8") as file:
         writer = csv.writer(file)
         writer.writerows(data)
+
+# Применение одного события из журнала к агрегатам в памяти
+def _apply_event(event):
+    last_updated, user_id, username, start_count, forecast_count, payment_count, usage_time = event[:7]
+    row = _aggregates.get(user_id)
+    if row is None:
+        row = _aggregates[user_id] = [username, 0, 0, 0, 0.0, last_updated]
+    row[0] = username
+    row[1] += int(start_count)
+    row[2] += int(forecast_count)
+    row[3] += int(payment_count)
+    row[4] += float(usage_time)
+    row[5] = last_updated
+
+# Загрузка агрегатов: последний снимок из CSV плюс ещё не свёрнутые события из журнала
+def load_aggregates():
+    _aggregates.clear()
+    for row in read_csv_data()[1:]:
+        if row:
+            _aggregates[row[1]] = [row[0], int(row[2]), int(row[3]), int(row[4]), float(row[5]), row[6]]
+    if os.path.exists(EVENTS_FILE):
+        with open(EVENTS_FILE, mode="r", newline="", encoding="utf-8") as file:
+            for event in csv.reader(file):
+                # Последняя строка могла записаться не полностью при падении процесса
+                if len(event) not in (7, 8):
+                    continue
+                try:
+                    _apply_event(event)
+                except ValueError:
+                    continue
+
+# Дозапись пачки событий в журнал с fsync
+def _append_events(batch):
+    with open(EVENTS_FILE, mode="a", newline="", encoding="utf-8") as file:
+        start = file.tell()
+        try:
+            writer = csv.writer(file)
+            writer.writerows(batch)
+            file.flush()
+            os.fsync(file.fileno())
+        except OSError:
+            # Пачка будет записана повторно — отрезаем её недописанную часть
+            try:
+                file.truncate(start)
+            except OSError:
+                pass
+            raise
+
+# Сворачивание журнала: снимок агрегатов пишется в CSV в прежнем формате, журнал очищается
+def _compact(snapshot):
+    tmp_file = CSV_FILE + ".tmp"
+    with open(tmp_file, mode="w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(CSV_HEADER)
+        for user_id, (username, start_count, forecast_count, payment_count, usage_time, last_updated) in snapshot.items():
+            writer.writerow([
+                username,
+                user_id,
+                str(start_count),
+                str(forecast_count),
+                str(payment_count),
+                str(usage_time),
+                last_updated
+            ])
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_file, CSV_FILE)
+    open(EVENTS_FILE, mode="w", encoding="utf-8").close()
+
+def _snapshot():
+    return {user_id: list(row) for user_id, row in _aggregates.items()}
+
+# Регистрация события: агрегаты обновляются сразу, запись на диск уходит в фоновую задачу
+# Выставленные счета (invoice_count) попадают только в дневные сводки, в CSV по пользователям их нет.
+def record_event(username, user_id, start_count=0, forecast_count=0, payment_count=0, usage_time=0, invoice_count=0):
+    event = [
+        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        str(user_id),
+        username or "",
+        str(start_count),
+        str(forecast_count),
+        str(payment_count),
+        str(round(usage_time, 4)),
+        str(invoice_count)
+    ]
+    if ANALYTICS_BACKEND == "sqlite":
+        _record_sqlite_event(event)
+        return
+    _apply_event(event)
+    if _event_queue is not None:
+        _event_queue.put_nowait(event)
+    else:
+        # Фоновая задача не запущена (например, в скриптах) — пишем сразу
+        _append_events([event])
+        _write_rollups([event])
+
+# Фоновая задача: собирает события пачками, пишет их в журнал и периодически сворачивает его.
+# Пачка, которую не удалось записать, остаётся и повторяется не реже раза в WRITE_RETRY_DELAY.
+# Если не пишется журнал, запасной путь — сворачивание в CSV; ожидающих сводок событий не больше ROLLUP_BACKLOG.
+async def _writer_loop():
+    last_compact = time.monotonic()
+    unlogged = []  # события, ещё не попавшие в журнал
+    unrolled = []  # события, ещё не учтённые в дневных сводках
+    running = True
+    while running:
+        if unlogged or unrolled:
+            try:
+                batch = [await asyncio.wait_for(_event_queue.get(), WRITE_RETRY_DELAY)]
+            except asyncio.TimeoutError:
+                batch = []
+        else:
+            batch = [await _event_queue.get()]
+        await asyncio.sleep(FLUSH_INTERVAL)
+        while not _event_queue.empty():
+            batch.append(_event_queue.get_nowait())
+        # None — сигнал остановки от stop_analytics
+        if None in batch:
+            running = False
+            batch = [event for event in batch if event is not None]
+        unlogged += batch
+        unrolled += batch
+        if len(unrolled) > ROLLUP_BACKLOG:
+            dropped = len(unrolled) - ROLLUP_BACKLOG
+            logging.error(
+                "Дневные сводки недоступны, отброшено %s старейших событий (с %s по %s)",
+                dropped, unrolled[0][0], unrolled[dropped - 1][0]
+            )
+            ANALYTICS_ROLLUP_DROPPED.inc(amount=dropped)
+            del unrolled[:dropped]
+        if unlogged:
+            try:
+                with ANALYTICS_WRITE_SECONDS.time("csv"):
+                    await asyncio.to_thread(_append_events, unlogged)
+                unlogged = []
+            except OSError as e:
+                logging.error("Не удалось записать в журнал %s событий аналитики: %s", len(unlogged), e)
+        if unrolled:
+            try:
+                await asyncio.to_thread(_write_rollups, unrolled)
+                unrolled = []
+            except (OSError, sqlite3.Error) as e:
+                logging.error("Не удалось обновить дневные сводки на %s событий: %s", len(unrolled), e)
+        # Снимок берётся только когда очередь пуста: всё, что в нём есть, уже в журнале или в unlogged.
+        # Незаписанные в журнал события после сворачивания уже в CSV, повторять их не нужно.
+        due = unlogged or time.monotonic() - last_compact >= COMPACT_INTERVAL
+        if running and due and _event_queue.empty():
+            try:
+                await asyncio.to_thread(_compact, _snapshot())
+                unlogged = []
+            except OSError as e:
+                logging.error("Не удалось свернуть журнал аналитики: %s", e)
+            last_compact = time.monotonic()
+    # Незаписанные в журнал события попадут в CSV при последнем сворачивании в stop_analytics
+    if unrolled:
+        logging.error("Дневные сводки не получили %s событий аналитики", len(unrolled))
+
+async def start_analytics():
+    global _event_queue, _writer_task
+    if ANALYTICS_BACKEND == "sqlite":
+        start_sqlite_writer()
+        return
+    await asyncio.to_thread(load_aggregates)
+    _event_queue = asyncio.Queue()
+    _writer_task = asyncio.create_task(_writer_loop())
+
+async def stop_analytics():
+    global _event_queue, _writer_task
+    if ANALYTICS_BACKEND == "sqlite":
+        await asyncio.to_thread(stop_sqlite_writer)
+        return
+    if _writer_task is None:
+        return
+    _event_queue.put_nowait(None)
+    await _writer_task
+    _event_queue = None
+    _writer_task = None
+    await asyncio.to_thread(_compact, _snapshot())
+
+def connect_sqlite(db_path=None):
+    # timeout: в режиме вебхука в базу пишут несколько процессов
+    conn = sqlite3.connect(db_path or SQLITE_FILE, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    for statement in SQLITE_SCHEMA + ROLLUP_SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+def read_sqlite_data():
+    conn = connect_sqlite()
+    try:
+        rows = conn.execute(
+            "SELECT username, user_id, start_count, forecast_count, payment_count, usage_time, last_updated FROM analytics"
+        ).fetchall()
+    finally:
+        conn.close()
+    return [[str(value) for value in row] for row in rows]
+
+def _sqlite_row(event):
+    last_updated, user_id, username, start_count, forecast_count, payment_count, usage_time = event[:7]
+    return (username, user_id, int(start_count), int(forecast_count), int(payment_count), float(usage_time), last_updated)
+
+def _record_sqlite_event(event):
+    if _sqlite_queue is not None:
+        _sqlite_queue.put(event)
+        return
+    conn = connect_sqlite()
+    try:
+        with conn:
+            conn.execute(SQLITE_UPSERT, _sqlite_row(event))
+            _apply_rollups(conn, [event])
+    finally:
+        conn.close()
+
+# Отдельный поток: все события за FLUSH_INTERVAL записываются одной транзакцией.
+# При ошибке транзакция откатывается, соединение открывается заново, а пачка повторяется
+# вместе с новыми событиями не реже раза в WRITE_RETRY_DELAY.
+def _sqlite_writer_loop(event_queue, db_path):
+    conn = None
+    pending = []
+    running = True
+    while running:
+        try:
+            batch = [event_queue.get(timeout=WRITE_RETRY_DELAY if pending else None)]
+        except queue.Empty:
+            batch = []
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while batch and batch[-1] is not None:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(event_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        # None — сигнал остановки от stop_sqlite_writer
+        if batch and batch[-1] is None:
+            running = False
+            batch.pop()
+        pending += batch
+        if not pending:
+            continue
+        try:
+            if conn is None:
+                conn = connect_sqlite(db_path)
+            with ANALYTICS_WRITE_SECONDS.time("sqlite"), conn:
+                conn.executemany(SQLITE_UPSERT, map(_sqlite_row, pending))
+                _apply_rollups(conn, pending)
+            pending = []
+        except (OSError, sqlite3.Error) as e:
+            logging.error("Не удалось записать в SQLite %s событий аналитики: %s", len(pending), e)
+            if conn is not None:
+                conn.close()
+                conn = None
+    if pending:
+        logging.error("События аналитики не записаны при остановке: %s", len(pending))
+    if conn is not None:
+        conn.close()
+
+def start_sqlite_writer():
+    global _sqlite_queue, _sqlite_thread
+    _sqlite_queue = queue.Queue()
+    _sqlite_thread = threading.Thread(
+        target=_sqlite_writer_loop, args=(_sqlite_queue, SQLITE_FILE), name="analytics-sqlite", daemon=True
+    )
+    _sqlite_thread.start()
+
+def stop_sqlite_writer():
+    global _sqlite_queue, _sqlite_thread
+    if _sqlite_thread is None:
+        return
+    _sqlite_queue.put(None)
+    _sqlite_thread.join()
+    _sqlite_queue = None
+    _sqlite_thread = None
+
+# Разовый перенос существующих analytics.csv и журнала событий в SQLite.
+# Значения записываются целиком, поэтому повторный запуск не удваивает счётчики.
+def import_csv_to_sqlite(db_path=None):
+    load_aggregates()
+    conn = connect_sqlite(db_path)
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO analytics VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (username, user_id, start_count, forecast_count, payment_count, usage_time, last_updated)
+                    for user_id, (username, start_count, forecast_count, payment_count, usage_time, last_updated)
+                    in _aggregates.items()
+                )
+            )
+    finally:
+        conn.close()
+    return len(_aggregates)
+
+# Приращения дневных сводок за пачку событий: {день: [start, forecast, invoice, payment, usage]}
+# и пары (день, user_id) для подсчёта активных пользователей
+def _rollup_deltas(events):
+    days = {}
+    visits = set()
+    for event in events:
+        day = event[0][:10]
+        row = days.get(day)
+        if row is None:
+            row = days[day] = [0, 0, 0, 0, 0.0]
+        row[0] += int(event[3])
+        row[1] += int(event[4])
+        row[2] += int(event[7]) if len(event) > 7 else 0
+        row[3] += int(event[5])
+        row[4] += float(event[6])
+        visits.add((day, event[1]))
+    return days, visits
+
+# Обновление дневных сводок в текущей транзакции conn
+def _apply_rollups(conn, events, prune=True):
+    days, visits = _rollup_deltas(events)
+    active = dict.fromkeys(days, 0)
+    for visit in visits:
+        # Пользователь считается активным один раз за день, даже если пишут несколько процессов
+        if conn.execute("INSERT OR IGNORE INTO analytics_daily_users VALUES (?, ?)", visit).rowcount:
+            active[visit[0]] += 1
+    conn.executemany(
+        ROLLUP_UPSERT,
+        ((day, active[day], *row) for day, row in days.items())
+    )
+    if prune:
+        _prune_rollup_users(conn)
+
+# Прошедшие дни уже посчитаны, их пользователей можно забыть
+def _prune_rollup_users(conn):
+    horizon = (datetime.now() - timedelta(days=ROLLUP_USER_DAYS)).strftime("%Y-%m-%d")
+    conn.execute("DELETE FROM analytics_daily_users WHERE day < ?", (horizon,))
+
+def _write_rollups(events, db_path=None):
+    conn = connect_sqlite(db_path)
+    try:
+        with conn:
+            _apply_rollups(conn, events)
+    finally:
+        conn.close()
+
+# Чтение журнала событий построчно, без загрузки файла в память
+def iter_events(path=EVENTS_FILE):
+    with open(path, mode="r", newline="", encoding="utf-8") as file:
+        for event in csv.reader(file):
+            if len(event) in (7, 8):
+                yield event
+
+# Досчёт дневных сводок из журнала событий за один проход: события пишутся пачками,
+# так что память не зависит от размера журнала. Журнал раз в COMPACT_INTERVAL очищается при сворачивании,
+# поэтому полной истории в нём нет: дни, для которых сводка уже есть, пропускаются, а не заменяются.
+# Возвращает (учтено событий, пропущено событий).
+def rebuild_rollups(events, db_path=None, batch_size=10000):
+    conn = connect_sqlite(db_path)
+    count = 0
+    skipped = 0
+    batch = []
+    try:
+        existing = {day for (day,) in conn.execute("SELECT day FROM analytics_daily")}
+        for event in events:
+            if event[0][:10] in existing:
+                skipped += 1
+                continue
+            batch.append(event)
+            count += 1
+            if len(batch) >= batch_size:
+                with conn:
+                    _apply_rollups(conn, batch, prune=False)
+                batch = []
+        with conn:
+            _apply_rollups(conn, batch, prune=False)
+            _prune_rollup_users(conn)
+    finally:
+        conn.close()
+    return count, skipped
+
+def _ratio(numerator, denominator):
+    return numerator / denominator if denominator else 0.0
+
+# Воронка и активность по дневным сводкам: стоимость зависит от числа дней, а не событий
+def read_stats(days=7, db_path=None):
+    conn = connect_sqlite(db_path)
+    try:
+        totals = conn.execute(
+            "SELECT COALESCE(SUM(start_count), 0), COALESCE(SUM(forecast_count), 0), "
+            "COALESCE(SUM(invoice_count), 0), COALESCE(SUM(payment_count), 0), "
+            "COALESCE(SUM(usage_time), 0), COALESCE(SUM(active_users), 0) FROM analytics_daily"
+        ).fetchone()
+        daily = conn.execute(
+            "SELECT day, active_users, start_count, forecast_count, invoice_count, payment_count, usage_time "
+            "FROM analytics_daily ORDER BY day DESC LIMIT ?",
+            (days,)
+        ).fetchall()
+    finally:
+        conn.close()
+    starts, forecasts, invoices, payments, usage_time, user_days = totals
+    return {
+        "starts": starts,
+        "forecasts": forecasts,
+        "invoices": invoices,
+        "payments": payments,
+        "start_to_forecast": _ratio(forecasts, starts),
+        "forecast_to_invoice": _ratio(invoices, forecasts),
+        "invoice_to_payment": _ratio(payments, invoices),
+        "start_to_payment": _ratio(payments, starts),
+        "dau": _ratio(sum(row[1] for row in daily), len(daily)),
+        # Среднее время использования на активного пользователя за день (мин)
+        "avg_usage_time": _ratio(usage_time, user_days),
+        "daily": [
+            {"day": day, "active_users": active, "starts": start, "forecasts": forecast,
+             "invoices": invoice, "payments": payment, "usage_time": usage}
+            for day, active, start, forecast, invoice, payment, usage in daily
+        ],
+    }
+
+# Текст отчёта для /stats и командной строки
+def format_stats(stats):
+    lines = [
+        "<b>📊 Воронка за всё время</b>",
+        f"/start: {stats['starts']}",
+        f"Прогнозы: {stats['forecasts']} ({stats['start_to_forecast']:.1%} от /start)",
+        f"Счета: {stats['invoices']} ({stats['forecast_to_invoice']:.1%} от прогнозов)",
+        f"Оплаты: {stats['payments']} ({stats['invoice_to_payment']:.1%} от счетов, "
+        f"{stats['start_to_payment']:.1%} от /start)",
+        "",
+        f"<b>Активные пользователи в день</b> (за {len(stats['daily'])} дн.): {stats['dau']:.1f}",
+        f"Среднее время использования: {stats['avg_usage_time']:.1f} мин",
+    ]
+    for row in stats["daily"]:
+        lines.append(
+            f"{row['day']}: {row['active_users']} польз., /start {row['starts']}, прогнозы {row['forecasts']}, "
+            f"счета {row['invoices']}, оплаты {row['payments']}"
+        )
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Аналитика бота")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import-csv", help="перенести analytics.csv в SQLite")
+    import_parser.add_argument("--db", default=SQLITE_FILE)
+    stats_parser = commands.add_parser("stats", help="воронка и активность по дневным сводкам")
+    stats_parser.add_argument("--db", default=SQLITE_FILE)
+    stats_parser.add_argument("--days", type=int, default=7)
+    rollup_parser = commands.add_parser(
+        "rebuild-rollups", help="досчитать дневные сводки за дни, которых ещё нет, из журнала событий"
+    )
+    rollup_parser.add_argument("--events", default=EVENTS_FILE)
+    rollup_parser.add_argument("--db", default=SQLITE_FILE)
+    args = parser.parse_args()
+
+    if args.command == "import-csv":
+        count = import_csv_to_sqlite(args.db)
+        print(f"Перенесено пользователей: {count} → {args.db}")
+    elif args.command == "stats":
+        print(_TAG_RE.sub("", format_stats(read_stats(args.days, args.db))))
+    elif args.command == "rebuild-rollups":
+        if not os.path.exists(args.events):
+            # При ANALYTICS_BACKEND=sqlite события сразу пишутся в базу вместе со сводками, журнала нет
+            parser.exit(1, f"Журнал событий {args.events} не найден: досчитывать сводки не из чего\n")
+        count, skipped = rebuild_rollups(iter_events(args.events), args.db)
+        print(f"Учтено событий: {count}, пропущено за дни с готовой сводкой: {skipped} → {args.db}")
+
+if __name__ == "__main__":
+    main()
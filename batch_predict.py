@@ -0,0 +1,191 @@
+# Пакетная генерация прогнозов для офлайн-сравнения промптов.
+# Вход — JSONL с анкетами: {"id": ..., "text": "...", "future": false, "previous": "..."}; id по умолчанию — номер строки.
+# Результаты дописываются в выходной JSONL по мере готовности; он же служит контрольной точкой:
+# при повторном запуске уже обработанные id пропускаются.
+# Запуск: python -m batch_predict --input forms.jsonl --output predictions.jsonl [--base-url http://127.0.0.1:8082/v1]
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import time
+
+from questionnaire import parse_questionnaire
+
+# Как часто сбрасывать выходной файл на диск (записей)
+CHECKPOINT_EVERY = int(os.getenv("BATCH_CHECKPOINT_EVERY", "20"))
+
+# Чтение входного файла построчно: память не зависит от размера корпуса
+def read_forms(path):
+    with open(path, mode="r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            form = json.loads(line)
+            form.setdefault("id", line_number)
+            yield form
+
+# id уже обработанных анкет из выходного файла. Оборванная при падении последняя строка отбрасывается.
+# С retry_errors анкеты с ошибкой обрабатываются снова, новая запись дописывается после старой.
+def load_checkpoint(path, retry_errors=False):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    valid_size = 0
+    with open(path, mode="rb") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            valid_size += len(line)
+            if not (retry_errors and record.get("error")):
+                done.add(record["id"])
+    if valid_size != os.path.getsize(path):
+        with open(path, mode="r+b") as file:
+            file.truncate(valid_size)
+    return done
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+class BatchReport:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.completed = 0
+        self.errors = 0
+        self.skipped = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latencies = []
+
+    def as_dict(self):
+        elapsed = time.monotonic() - self.started
+        latency = {}
+        if self.latencies:
+            latency = {
+                "p50": statistics.median(self.latencies),
+                "p95": _percentile(self.latencies, 0.95),
+                "p99": _percentile(self.latencies, 0.99),
+                "max": max(self.latencies),
+                "mean": statistics.fmean(self.latencies),
+            }
+        return {
+            "completed": self.completed,
+            "errors": self.errors,
+            "skipped": self.skipped,
+            "elapsed_seconds": elapsed,
+            "predictions_per_second": self.completed / elapsed if elapsed else 0.0,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens,
+            "latency_seconds": latency,
+        }
+
+# Одна анкета: тот же разбор, что в боте, и generate_prediction без кэша (если не задано иное)
+async def predict_one(generate_prediction, form, report, use_cache):
+    record = {"id": form["id"]}
+    usage = {}
+    questionnaire = parse_questionnaire(form.get("text", ""))
+    if questionnaire is None:
+        record["error"] = "анкета не распознана"
+        return record
+    started = time.monotonic()
+    try:
+        record["prediction"] = await generate_prediction(
+            questionnaire,
+            future_mode=bool(form.get("future")),
+            previous_response=form.get("previous"),
+            use_cache=use_cache,
+            on_usage=lambda value: usage.update(
+                prompt_tokens=value.prompt_tokens, completion_tokens=value.completion_tokens
+            ) if value is not None else None,
+        )
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        return record
+    record["latency"] = round(time.monotonic() - started, 4)
+    record["usage"] = usage
+    report.latencies.append(record["latency"])
+    report.prompt_tokens += usage.get("prompt_tokens") or 0
+    report.completion_tokens += usage.get("completion_tokens") or 0
+    return record
+
+# concurrency обработчиков берут анкеты из общего потока; порядок в выходном файле — по готовности
+async def run_batch(input_path, output_path, concurrency=8, use_cache=False, retry_errors=False, limit=None):
+    # Настройки gpt и load_shedding читаются при импорте, поэтому импорт — после того, как main задаст окружение
+    from gpt import generate_prediction
+
+    report = BatchReport()
+    done = load_checkpoint(output_path, retry_errors)
+    forms = read_forms(input_path)
+    taken = 0
+
+    def next_form():
+        nonlocal taken
+        for form in forms:
+            if form["id"] in done:
+                report.skipped += 1
+                continue
+            if limit is not None and taken >= limit:
+                return None
+            taken += 1
+            return form
+        return None
+
+    with open(output_path, mode="a", encoding="utf-8") as output:
+        unsynced = 0
+
+        async def worker():
+            nonlocal unsynced
+            while (form := next_form()) is not None:
+                record = await predict_one(generate_prediction, form, report, use_cache)
+                if "error" in record:
+                    report.errors += 1
+                    logging.warning("Анкета %s: %s", record["id"], record["error"])
+                else:
+                    report.completed += 1
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                unsynced += 1
+                if unsynced >= CHECKPOINT_EVERY:
+                    output.flush()
+                    os.fsync(output.fileno())
+                    unsynced = 0
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        output.flush()
+        os.fsync(output.fileno())
+    return report.as_dict()
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная генерация прогнозов по анкетам из JSONL")
+    parser.add_argument("--input", required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--limit", type=int, default=None, help="обработать не больше N анкет за запуск")
+    parser.add_argument("--use-cache", action="store_true", help="брать готовые прогнозы из кэша")
+    parser.add_argument("--retry-errors", action="store_true", help="повторить анкеты, завершившиеся ошибкой")
+    parser.add_argument("--base-url", default=None, help="OpenAI-совместимый сервер, например локальная заглушка")
+    parser.add_argument("--report", default=None, help="куда сохранить отчёт в JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    # Адрес сервера задаётся до первого запроса: клиент OpenAI создаётся при первом обращении.
+    # Оценке промптов нужны полные прогнозы, поэтому сокращение под нагрузкой выключено.
+    os.environ.setdefault("LOAD_SHEDDING", "0")
+    if args.base_url:
+        os.environ["OPENAI_BASE_URL"] = args.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "batch")
+    report = asyncio.run(run_batch(
+        args.input, args.output, args.concurrency, args.use_cache, args.retry_errors, args.limit
+    ))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.report:
+        with open(args.report, mode="w", encoding="utf-8") as file:
+            file.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Бенчмарк стоимости одного события аналитики в зависимости от числа пользователей.
+# Запуск из корня репозитория: python -m benchmarks.bench_analytics
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import analytics
+
+
+def populate_sqlite(db_path, users):
+    conn = analytics.connect_sqlite(db_path)
+    with conn:
+        conn.executemany(
+            "INSERT INTO analytics VALUES (?, ?, 1, 1, 0, 1.0, '2025-01-01 00:00:00')",
+            ((f"user{i}", str(i)) for i in range(users))
+        )
+    conn.close()
+
+
+def bench_sqlite(users, events):
+    with tempfile.TemporaryDirectory() as tmp:
+        analytics.ANALYTICS_BACKEND = "sqlite"
+        analytics.SQLITE_FILE = os.path.join(tmp, "analytics.db")
+        populate_sqlite(analytics.SQLITE_FILE, users)
+
+        analytics.start_sqlite_writer()
+        user_ids = [random.randrange(users) for _ in range(events)]
+        started = time.perf_counter()
+        for user_id in user_ids:
+            analytics.record_event(f"user{user_id}", user_id, forecast_count=1, usage_time=0.5)
+        enqueued = time.perf_counter()
+        analytics.stop_sqlite_writer()
+        flushed = time.perf_counter()
+    return (enqueued - started) / events, (flushed - started) / events
+
+
+def populate_csv(csv_path, users):
+    with open(csv_path, mode="w", newline="", encoding="utf-8") as file:
+        file.write(",".join(analytics.CSV_HEADER) + "\n")
+        for i in range(users):
+            file.write(f"user{i},{i},1,1,0,1.0,2025-01-01 00:00:00\n")
+
+
+def bench_csv_rewrite(users, events):
+    with tempfile.TemporaryDirectory() as tmp:
+        analytics.ANALYTICS_BACKEND = "csv"
+        analytics.CSV_FILE = os.path.join(tmp, "analytics.csv")
+        populate_csv(analytics.CSV_FILE, users)
+        started = time.perf_counter()
+        for _ in range(events):
+            user_id = random.randrange(users)
+            analytics.update_analytics_data(f"user{user_id}", user_id, forecast_count=1, usage_time=0.5)
+        return (time.perf_counter() - started) / events
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Стоимость события аналитики: SQLite против перезаписи CSV")
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000")
+    parser.add_argument("--csv-sizes", default="1000,10000,100000")
+    args = parser.parse_args()
+    analytics.FLUSH_INTERVAL = 0.05
+
+    print("SQLite (WAL, пакетные upsert'ы)")
+    print(f"{'пользователей':>14} {'в хендлере, мкс':>16} {'с записью, мкс':>15}")
+    for users in map(int, args.sizes.split(",")):
+        enqueue_cost, total_cost = bench_sqlite(users, args.events)
+        print(f"{users:>14} {enqueue_cost * 1e6:>16.1f} {total_cost * 1e6:>15.1f}")
+
+    print("\nCSV (старая полная перезапись файла)")
+    print(f"{'пользователей':>14} {'на событие, мкс':>16}")
+    for users in map(int, args.csv_sizes.split(",")):
+        events = max(10, min(args.events, 2_000_000 // users))
+        print(f"{users:>14} {bench_csv_rewrite(users, events) * 1e6:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# Хвостовая задержка запросов к OpenAI с дублированием и без, на фейковом API с медленными ответами.
+# --mixed чередует потоковые и обычные запросы: у каждого вида своё окно задержек для дублирования.
+# Запуск из корня репозитория: python -m benchmarks.bench_hedging
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import time
+
+from benchmarks.fake_openai import start_fake_openai
+from benchmarks.replay_updates import free_port
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+async def run_requests(gpt, sample_form, rng, requests, concurrency, stream, mixed=False):
+    limiter = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one():
+        nonlocal failures
+        async with limiter:
+            started = time.monotonic()
+            try:
+                if rng.random() < 0.5 if mixed else stream:
+                    async for _ in gpt.stream_prediction(sample_form(rng), use_cache=False):
+                        pass
+                else:
+                    await gpt.generate_prediction(sample_form(rng), use_cache=False)
+            except Exception as e:
+                failures += 1
+                print(f"ошибка запроса: {type(e).__name__}: {e}")
+                return
+            latencies.append(time.monotonic() - started)
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies, failures
+
+
+async def run(args):
+    # Отменённый проигравший поток фейковый сервер дописывает в закрытое соединение — это ожидаемо
+    logging.getLogger("aiohttp.server").setLevel(logging.CRITICAL)
+    port = free_port()
+    fake, runner = await start_fake_openai(
+        port=port, first_token=args.first_token, token_delay=args.token_delay, tokens=args.tokens,
+        error_rate=args.error_rate, slow_rate=args.slow_rate, slow_factor=args.slow_factor
+    )
+    os.environ.update(OPENAI_API_KEY="bench", OPENAI_BASE_URL=f"http://127.0.0.1:{port}/v1")
+    import gpt
+    import llm_policy
+    from benchmarks.bench_prompts import sample_form
+
+    rng = random.Random(args.seed)
+    # Окно задержек наполняется до включения дублирования
+    await run_requests(
+        gpt, sample_form, rng, llm_policy.HEDGE_MIN_SAMPLES * (4 if args.mixed else 2), args.concurrency,
+        args.stream, args.mixed
+    )
+
+    print(f"{'режим':>14} {'p50, с':>7} {'p95, с':>7} {'p99, с':>7} {'max, с':>7} {'запросов к API':>15} {'ошибок':>7}")
+    for hedge in (False, True):
+        llm_policy.HEDGE_ENABLED = hedge
+        before = fake.requests
+        latencies, failures = await run_requests(
+            gpt, sample_form, rng, args.requests, args.concurrency, args.stream, args.mixed
+        )
+        print(
+            f"{'с дублем' if hedge else 'без дубля':>14} {statistics.median(latencies):>7.2f} "
+            f"{percentile(latencies, 0.95):>7.2f} {percentile(latencies, 0.99):>7.2f} {max(latencies):>7.2f} "
+            f"{fake.requests - before:>15} {failures:>7}"
+        )
+    for series in ("full", "stream"):
+        delay = llm_policy.latency_tracker.hedge_delay((llm_policy.PRIMARY_MODEL, series))
+        if delay is not None:
+            print(f"задержка дублирования ({series}): {delay:.2f} с")
+    await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Дублирование запросов к OpenAI против хвостовой задержки")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--first-token", type=float, default=0.3)
+    parser.add_argument("--token-delay", type=float, default=0.002)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--slow-rate", type=float, default=0.03)
+    parser.add_argument("--slow-factor", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--mixed", action="store_true", help="половина запросов потоковые, половина обычные")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# Цена логирования для цикла событий: обработчики пишут строки лога, пока вывод медленный
+# (заполненный pipe, перегруженный journald). Сравнивается прямая запись в stderr через basicConfig
+# и очередь с потоком записи из log_config. Запуск из корня репозитория: python -m benchmarks.bench_logging
+import argparse
+import asyncio
+import io
+import logging
+import statistics
+import time
+
+import log_config
+
+
+# Поток вывода, каждая запись в который занимает заданное время
+class SlowStream(io.StringIO):
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+        self.writes = 0
+
+    def write(self, text):
+        time.sleep(self.delay)
+        self.writes += 1
+        return len(text)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+async def measure(args):
+    lags = []
+    calls = []
+    stop = asyncio.Event()
+
+    async def monitor():
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append(max(0.0, time.perf_counter() - started - 0.005))
+
+    async def handler(chat_id):
+        for _ in range(args.lines):
+            started = time.perf_counter()
+            logging.info("Получена анкета от chat_id %s", chat_id)
+            logging.info("Необработанное сообщение: %s от chat_id %s", "стикер", chat_id, extra={"category": "unhandled"})
+            calls.append((time.perf_counter() - started) / 2)
+            await asyncio.sleep(0)
+
+    monitor_task = asyncio.create_task(monitor())
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(chat_id) for chat_id in range(args.handlers)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor_task
+    return elapsed, calls, lags
+
+
+def reset_logging():
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Задержка цикла событий от записи логов в медленный вывод")
+    parser.add_argument("--handlers", type=int, default=100)
+    parser.add_argument("--lines", type=int, default=20, help="пар строк лога на обработчик")
+    parser.add_argument("--write-delay", type=float, default=0.0005, help="время одной записи в вывод (сек)")
+    args = parser.parse_args()
+
+    print(f"{'режим':>22} {'всего, с':>9} {'вызов p50, мкс':>15} {'вызов p99, мкс':>15} "
+          f"{'лаг p99, мс':>12} {'лаг max, мс':>12} {'записей':>8}")
+    for mode in ("basicConfig", "очередь + выборка"):
+        reset_logging()
+        stream = SlowStream(args.write_delay)
+        if mode == "basicConfig":
+            logging.basicConfig(level=logging.INFO, format=log_config.TEXT_FORMAT, stream=stream, force=True)
+        else:
+            log_config.setup_logging(level="INFO", stream=stream)
+        elapsed, calls, lags = asyncio.run(measure(args))
+        if mode != "basicConfig":
+            log_config.stop_logging()
+        print(
+            f"{mode:>22} {elapsed:>9.2f} {statistics.median(calls) * 1e6:>15.1f} {percentile(calls, 0.99) * 1e6:>15.1f} "
+            f"{percentile(lags, 0.99) * 1e3:>12.1f} {max(lags) * 1e3:>12.1f} {stream.writes:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# Сравнение промпта из сырого текста анкеты и компактного промпта из разобранной записи.
+# Запуск из корня репозитория: python -m benchmarks.bench_prompts [--forms forms.jsonl] [--live]
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+
+from gpt import build_messages, get_client
+from questionnaire import format_questionnaire, parse_questionnaire
+
+# Шаблон из сообщения бота: пользователи копируют его вместе с разметкой и подсказками
+TEMPLATE = [
+    ("<i>Мой возраст: (например, 25)</i>", ["25", "34", "41", "19", "57"]),
+    ("<i>Страна, где я живу: (например, Россия)</i>", ["Россия", "Казахстан", "Германия", "Грузия"]),
+    ("<i>Семейное положение: (например, не женат/замужем)</i>", ["не женат", "замужем, двое детей", "в разводе"]),
+    ("<i>Мои 3-5 главных интересов: (например, путешествия, книги, спорт)</i>",
+     ["рыбалка, футбол, сериалы", "йога, кулинария, языки, путешествия", "игры, музыка"]),
+    ("<i>Как я зарабатываю на жизнь: (например, работаю программистом)</i>",
+     ["работаю бухгалтером в банке", "свой небольшой бизнес — кофейня", "фрилансер-дизайнер"]),
+    ("<i>Как я забочусь о своём здоровье: (например, хожу в спортзал 2 раза в неделю)</i>",
+     ["почти никак", "бегаю по утрам и слежу за питанием", "хожу к врачам раз в год"]),
+    ("<i>Моя рутина в жизни: (например, встаю в 7 утра, работаю до 18:00, вечером читаю)</i>",
+     ["работа до 19:00, вечером сериалы", "встаю в 6, спортзал, офис, дети", "сплю до обеда, работаю ночью"]),
+    ("<i>Моя самая большая мечта: (например, объездить весь мир)</i>",
+     ["дом у моря", "открыть свою школу", "выплатить ипотеку и путешествовать"]),
+]
+
+
+# Варианты заполнения: ответ вместо подсказки, после неё, с оставленной разметкой
+def sample_form(rng):
+    lines = []
+    for line, answers in TEMPLATE:
+        answer = rng.choice(answers)
+        style = rng.randrange(3)
+        if style == 0:
+            lines.append(line.replace("</i>", f" {answer}</i>"))
+        elif style == 1:
+            label = line[3:line.index(":") + 1]
+            lines.append(f"{label} {answer}")
+        else:
+            lines.append(line.replace(line[line.index("("):line.index(")") + 1], answer))
+    return "\n".join(lines)
+
+
+def load_forms(path):
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line)["text"] for line in file if line.strip()]
+
+
+# Токены считаются tiktoken, если он установлен; иначе — оценка по числу символов
+def token_counter():
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("o200k_base")
+        return lambda text: len(encoding.encode(text)), "tiktoken o200k_base"
+    except Exception:
+        return lambda text: round(len(text) / 3), "оценка: символы / 3"
+
+
+def prompt_text(messages):
+    return "".join(message["content"] for message in messages)
+
+
+async def live_latency(messages_list, max_tokens):
+    latencies = []
+    for messages in messages_list:
+        started = time.perf_counter()
+        await get_client().chat.completions.create(model="gpt-4o-mini", messages=messages, max_tokens=max_tokens)
+        latencies.append(time.perf_counter() - started)
+    return statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Экономия входных токенов компактного промпта")
+    parser.add_argument("--forms", help="JSONL с полем text")
+    parser.add_argument("--count", type=int, default=500)
+    parser.add_argument("--live", type=int, default=0, help="сколько анкет отправить в API для замера задержки")
+    parser.add_argument("--max-tokens", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(5)
+    forms = load_forms(args.forms) if args.forms else [sample_form(rng) for _ in range(args.count)]
+    count_tokens, method = token_counter()
+
+    started = time.perf_counter()
+    records = [parse_questionnaire(form) for form in forms]
+    parse_time = (time.perf_counter() - started) / len(forms)
+    parsed = [(form, record) for form, record in zip(forms, records) if record is not None]
+
+    raw_tokens = [count_tokens(prompt_text(build_messages(form))) for form, _ in parsed]
+    compact_tokens = [count_tokens(prompt_text(build_messages(record))) for _, record in parsed]
+    raw_data = [count_tokens(form) for form, _ in parsed]
+    compact_data = [count_tokens(format_questionnaire(record)) for _, record in parsed]
+
+    print(f"анкет: {len(forms)}, разобрано: {len(parsed)}, токены: {method}")
+    print(f"разбор и сборка промпта: {parse_time * 1e6:.1f} мкс на анкету")
+    print(f"данные анкеты: {statistics.mean(raw_data):.0f} → {statistics.mean(compact_data):.0f} токенов")
+    print(f"весь промпт:   {statistics.mean(raw_tokens):.0f} → {statistics.mean(compact_tokens):.0f} токенов "
+          f"(−{100 * (1 - sum(compact_tokens) / sum(raw_tokens)):.1f}%)")
+
+    if args.live:
+        sample = parsed[:args.live]
+        raw_latency = asyncio.run(live_latency([build_messages(form) for form, _ in sample], args.max_tokens))
+        compact_latency = asyncio.run(live_latency([build_messages(record) for _, record in sample], args.max_tokens))
+        print(f"медианная задержка ответа: {raw_latency * 1000:.0f} → {compact_latency * 1000:.0f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Разбиение длинного прогноза на сообщения: прежний split_text против однопроходного HTML-разбиения.
+# Запуск из корня репозитория: python -m benchmarks.bench_render
+import argparse
+import re
+import time
+
+from rendering import TELEGRAM_MESSAGE_LIMIT, render_bundle, split_text
+
+PARAGRAPH = (
+    "<b>1. Работа.</b> Через пять лет ты руководишь командой &amp; запускаешь <i>собственный продукт. "
+    "Каждое утро начинается с пробежки, а вечером ты читаешь книги о путешествиях.</i> "
+)
+_TAG_RE = re.compile(r"<(/?)(\w+)[^>]*>")
+
+
+# Разбиение до рендеринга: срез строки на каждом шаге цикла
+def legacy_split_text(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    parts = []
+    while len(text) > limit:
+        split_pos = text[:limit].rfind('\n')
+        if split_pos == -1:
+            split_pos = text[:limit].rfind(' ')
+            if split_pos == -1:
+                split_pos = limit
+        parts.append(text[:split_pos])
+        text = text[split_pos:].lstrip()
+    if text:
+        parts.append(text)
+    return parts
+
+
+# Сколько частей отправил бы Telegram с ошибкой разметки (незакрытые или разрезанные теги)
+def broken_parts(parts):
+    broken = 0
+    for part in parts:
+        stack = []
+        for match in _TAG_RE.finditer(part):
+            if match[1]:
+                if not stack or stack.pop() != match[2]:
+                    stack.append(None)
+                    break
+            else:
+                stack.append(match[2])
+        if stack or part.count("<") != part.count(">"):
+            broken += 1
+    return broken
+
+
+def measure(split, text, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        parts = split(text)
+    return (time.perf_counter() - started) / repeat, parts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Разбиение прогноза на сообщения Telegram")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4_000, 40_000, 400_000, 4_000_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'символов':>10} {'частей':>7} {'прежний, мс':>12} {'новый, мс':>10} {'битых частей':>14}")
+    for size in args.sizes:
+        text = PARAGRAPH * max(size // len(PARAGRAPH), 1)
+        legacy_time, legacy_parts = measure(legacy_split_text, text, args.repeat)
+        new_time, parts = measure(split_text, text, args.repeat)
+        assert all(len(part) <= TELEGRAM_MESSAGE_LIMIT for part in parts)
+        print(
+            f"{size:>10} {len(parts):>7} {legacy_time * 1000:>12.2f} {new_time * 1000:>10.2f} "
+            f"{broken_parts(legacy_parts):>6} -> {broken_parts(parts)}"
+        )
+
+    # Прогноз рендерится целиком один раз, при сохранении в сессию
+    text = PARAGRAPH * 30
+    started = time.perf_counter()
+    for _ in range(1000):
+        bundle = render_bundle(text)
+    print(f"рендер прогноза для сессии: {(time.perf_counter() - started) / 1000 * 1e3:.3f} мс")
+    print(f"длина ссылки 'Поделиться': {len(bundle.share_url)} символов")
+
+
+if __name__ == "__main__":
+    main()
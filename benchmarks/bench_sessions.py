@@ -0,0 +1,56 @@
+# Симуляция миллионов чатов при фиксированном лимите памяти хранилища сессий.
+# Запуск из корня репозитория: python -m benchmarks.bench_sessions
+import argparse
+import gc
+import random
+import resource
+import time
+
+from sessions import SessionStore
+
+PROMPT = (
+    "Мой возраст: 25\nСтрана, где я живу: Россия\nСемейное положение: не женат\n"
+    "Мои 3-5 главных интересов: путешествия, книги, спорт\nКак я зарабатываю на жизнь: программист\n"
+)
+PREDICTION = "1. Работа. " + "Через пять лет многое изменится. " * 60
+
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Хранилище сессий под нагрузкой миллионов чатов")
+    parser.add_argument("--chats", type=int, default=2_000_000)
+    parser.add_argument("--budget-mb", type=float, default=64)
+    parser.add_argument("--forecast-share", type=float, default=0.5)
+    args = parser.parse_args()
+
+    budget = int(args.budget_mb * 1024 * 1024)
+    store = SessionStore(ttl=3600, max_bytes=budget)
+    gc.collect()
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    for chat_id in range(args.chats):
+        session = store.get_or_create(chat_id)
+        # Уникальные строки, чтобы память не экономилась на общих объектах
+        session.prompt = PROMPT + str(chat_id)
+        if random.random() < args.forecast_share:
+            session.prediction = PREDICTION + str(chat_id)
+        store.save(session)
+        # Часть пользователей возвращается: их сессии должны переживать вытеснение
+        if chat_id % 10 == 0 and chat_id:
+            store.get(chat_id - random.randrange(min(chat_id, 1000)))
+        assert store.size_bytes <= budget or len(store) == 1
+    elapsed = time.perf_counter() - started
+    gc.collect()
+
+    stats = store.stats()
+    print(f"чатов: {args.chats}, за {elapsed:.1f} с ({args.chats / elapsed:,.0f} операций/с)")
+    print(f"сессий в памяти: {stats['sessions']}, учтено байт: {stats['size_bytes']:,} из {budget:,}")
+    print(f"вытеснено: {stats['evictions']}, просрочено: {stats['expirations']}")
+    print(f"прирост пикового RSS: {rss_mb() - rss_before:.1f} МБ при лимите {args.budget_mb:.0f} МБ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Холодный запуск бота в режиме polling: от запуска процесса до первого запроса обновлений
+# и до первого ответа пользователю на ожидающий /start. Bot API и OpenAI — фейковые.
+# Запуск из корня репозитория: python -m benchmarks.bench_startup --runs 5
+import argparse
+import asyncio
+import logging
+import os
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_openai import start_fake_openai
+from benchmarks.fake_telegram import start_fake_telegram
+from benchmarks.replay_updates import ROOT, free_port, generate_updates
+
+FIRST_UPDATE_RE = re.compile(r"Первое обновление обработано через ([\d.]+) с")
+
+
+async def wait_first_message(fake):
+    while fake.first_message is None:
+        await asyncio.sleep(0.005)
+
+
+async def run_once(args):
+    telegram_port, openai_port = free_port(), free_port()
+    fake, telegram_runner = await start_fake_telegram(port=telegram_port)
+    _, openai_runner = await start_fake_openai(port=openai_port)
+    fake.pending_updates = list(generate_updates(1, 1))
+    first_poll = None
+
+    async def watch_polls():
+        nonlocal first_poll
+        while not fake.calls["getupdates"]:
+            await asyncio.sleep(0.005)
+        first_poll = time.monotonic()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(
+            os.environ,
+            BOT_TOKEN="123456:STARTUP",
+            OPENAI_API_KEY="startup",
+            OPENAI_BASE_URL=f"http://127.0.0.1:{openai_port}/v1",
+            BOT_MODE="polling",
+            METRICS_PORT="0",
+            TELEGRAM_API_URL=f"http://127.0.0.1:{telegram_port}",
+        )
+        watcher = asyncio.create_task(watch_polls())
+        started = time.monotonic()
+        bot_process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(ROOT, "main.py"), cwd=workdir, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+        try:
+            await asyncio.wait_for(wait_first_message(fake), args.timeout)
+        finally:
+            watcher.cancel()
+            bot_process.send_signal(signal.SIGTERM)
+            _, stderr = await asyncio.wait_for(bot_process.communicate(), 60)
+            await telegram_runner.cleanup()
+            await openai_runner.cleanup()
+
+    match = FIRST_UPDATE_RE.search(stderr.decode("utf-8", "replace"))
+    return {
+        "first_poll": first_poll - started if first_poll else float("nan"),
+        "first_reply": fake.first_message - started,
+        # Время, которое бот сам насчитал от начала main.py, без запуска интерпретатора
+        "reported": float(match.group(1)) if match else float("nan"),
+    }
+
+
+async def run(args):
+    logging.getLogger("aiohttp.server").setLevel(logging.CRITICAL)
+    results = [await run_once(args) for _ in range(args.runs)]
+    print(f"{'':>26} {'медиана, с':>11} {'мин, с':>8} {'макс, с':>8}")
+    for key, title in (
+        ("first_poll", "до первого getUpdates"),
+        ("first_reply", "до ответа на /start"),
+        ("reported", "по логу бота"),
+    ):
+        values = [result[key] for result in results]
+        print(f"{title:>26} {statistics.median(values):>11.2f} {min(values):>8.2f} {max(values):>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время холодного запуска бота до первого обработанного обновления")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# /stats на синтетической истории из миллионов событий: перестроение сводок за один проход
+# и стоимость запроса в зависимости от размера истории.
+# Запуск из корня репозитория: python -m benchmarks.bench_stats
+import argparse
+import csv
+import os
+import random
+import resource
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import analytics
+
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Журнал событий в формате analytics_events.log: по дням, с воронкой /start → прогноз → счёт → оплата
+def write_events(path, events, days, users, seed=1):
+    rng = random.Random(seed)
+    first_day = datetime.now() - timedelta(days=days)
+    per_day = max(events // days, 1)
+    with open(path, mode="w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        for index in range(events):
+            moment = first_day + timedelta(days=index // per_day, seconds=index % per_day * 86400 // per_day)
+            user_id = rng.randrange(users)
+            stage = rng.random()
+            start, forecast, invoice, payment = (
+                (1, 0, 0, 0) if stage < 0.4 else
+                (0, 1, 0, 0) if stage < 0.75 else
+                (0, 0, 1, 0) if stage < 0.95 else
+                (0, 1, 0, 1)
+            )
+            writer.writerow([
+                moment.strftime("%Y-%m-%d %H:%M:%S"), user_id, f"user{user_id}",
+                start, forecast, payment, round(rng.random() * 3, 4), invoice
+            ])
+
+
+# Прямой подсчёт по журналу — столько же работы, сколько событий в истории
+def scan_events(path):
+    totals = [0, 0, 0, 0]
+    for event in analytics.iter_events(path):
+        totals[0] += int(event[3])
+        totals[1] += int(event[4])
+        totals[2] += int(event[7])
+        totals[3] += int(event[5])
+    return totals
+
+
+def measure(function, *args, repeat=1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = function(*args)
+    return (time.perf_counter() - started) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Дневные сводки аналитики на миллионах событий")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000_000, 3_000_000])
+    parser.add_argument("--users-per-event", type=float, default=0.1)
+    parser.add_argument("--events-per-day", type=int, default=20_000)
+    args = parser.parse_args()
+
+    print(f"{'событий':>10} {'дней':>5} {'сводки, с':>10} {'RSS, МБ':>8} {'/stats, мс':>11} {'прямой подсчёт, с':>18}")
+    for size in args.sizes:
+        days = max(size // args.events_per_day, 1)
+        with tempfile.TemporaryDirectory() as tmp:
+            events_path = os.path.join(tmp, "events.log")
+            db_path = os.path.join(tmp, "analytics.db")
+            write_events(events_path, size, days, max(int(size * args.users_per_event), 1))
+
+            rebuild_time, (count, _) = measure(analytics.rebuild_rollups, analytics.iter_events(events_path), db_path)
+            assert count == size
+            query_time, stats = measure(analytics.read_stats, 7, db_path, repeat=50)
+            scan_time, totals = measure(scan_events, events_path)
+            assert totals == [stats["starts"], stats["forecasts"], stats["invoices"], stats["payments"]]
+            print(
+                f"{size:>10} {days:>5} {rebuild_time:>10.1f} {rss_mb():>8.0f} "
+                f"{query_time * 1000:>11.2f} {scan_time:>18.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# Локальный OpenAI-совместимый сервер (/v1/chat/completions) с настраиваемой задержкой.
+# Поддерживает обычные и потоковые (stream=True) ответы.
+# Отдельный запуск: python -m benchmarks.fake_openai --port 8082
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+WORDS = (
+    "Через пять лет твоя жизнь заметно изменится: работа станет стабильнее, "
+    "появятся новые привычки, друзья и цели, а здоровье потребует больше внимания. "
+).split()
+
+
+class FakeOpenAI:
+    # slow_rate — доля «хвостовых» ответов, у которых задержка до первого токена в slow_factor раз больше
+    def __init__(self, first_token=0.3, token_delay=0.005, tokens=300, jitter=0.2, error_rate=0.0,
+                 slow_rate=0.0, slow_factor=10.0):
+        self.first_token = first_token
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.errors = 0
+
+    def _delay(self, base):
+        return base * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _first_token(self):
+        if self.slow_rate and random.random() < self.slow_rate:
+            return self._delay(self.first_token * self.slow_factor)
+        return self._delay(self.first_token)
+
+    def _usage(self, body, completion_tokens):
+        prompt_tokens = sum(len(message.get("content", "")) for message in body.get("messages", [])) // 3
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        }
+
+    def _words(self, body):
+        count = min(self.tokens, body.get("max_tokens") or self.tokens)
+        return [WORDS[i % len(WORDS)] + " " for i in range(count)]
+
+    async def completions(self, request):
+        body = await request.json()
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.error_rate and random.random() < self.error_rate:
+                self.errors += 1
+                await asyncio.sleep(self._delay(self.first_token))
+                return web.json_response({"error": {"message": "fake overload", "type": "server_error"}}, status=503)
+            if body.get("stream"):
+                return await self._stream(request, body)
+            words = self._words(body)
+            await asyncio.sleep(self._first_token() + self._delay(self.token_delay * len(words)))
+            return web.json_response({
+                "id": f"chatcmpl-fake-{self.requests}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(words)},
+                    "finish_reason": "stop",
+                }],
+                "usage": self._usage(body, len(words)),
+            })
+        finally:
+            self.in_flight -= 1
+
+    async def _stream(self, request, body):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        base = {
+            "id": f"chatcmpl-fake-{self.requests}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+        }
+
+        async def send(payload):
+            await response.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode())
+
+        await asyncio.sleep(self._first_token())
+        words = self._words(body)
+        for word in words:
+            await send({**base, "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]})
+            await asyncio.sleep(self.token_delay)
+        await send({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send({**base, "choices": [], "usage": self._usage(body, len(words))})
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    def stats_dict(self):
+        return {"requests": self.requests, "max_in_flight": self.max_in_flight, "errors": self.errors}
+
+    async def stats(self, request):
+        return web.json_response(self.stats_dict())
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.completions)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+
+async def start_fake_openai(host="127.0.0.1", port=8082, **options):
+    fake = FakeOpenAI(**options)
+    runner = web.AppRunner(fake.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return fake, runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фейковый OpenAI API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--first-token", type=float, default=0.3)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--tokens", type=int, default=300)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-factor", type=float, default=10.0)
+    args = parser.parse_args()
+
+    async def serve():
+        await start_fake_openai(
+            args.host, args.port, first_token=args.first_token, token_delay=args.token_delay,
+            tokens=args.tokens, error_rate=args.error_rate, slow_rate=args.slow_rate, slow_factor=args.slow_factor
+        )
+        print(json.dumps({"fake_openai": f"http://{args.host}:{args.port}/v1"}))
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
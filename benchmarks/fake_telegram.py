@@ -0,0 +1,107 @@
+# Локальный сервер, отвечающий как Bot API: для нагрузочных тестов без обращения к Telegram.
+# Отдельный запуск: python -m benchmarks.fake_telegram --port 8081
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+
+from aiohttp import web
+
+# Методы, которые возвращают объект Message
+MESSAGE_METHODS = {"sendmessage", "editmessagetext", "sendinvoice", "sendphoto", "senddocument"}
+
+
+def _message(chat_id, message_id, text):
+    return {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "text": text,
+    }
+
+
+class FakeTelegram:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.sent_by_chat = Counter()
+        self.message_ids = 0
+        self.first_call = None
+        self.last_call = None
+        # Обновления для getUpdates (режим polling) и момент первого ответа бота пользователю
+        self.pending_updates = []
+        self.first_message = None
+
+    async def handle(self, request):
+        method = request.match_info["method"].lower()
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        now = time.monotonic()
+        # getMe при запуске обработчиков — прогрев, а не обработка обновлений: время считается с первого другого вызова
+        if method != "getme":
+            self.first_call = self.first_call or now
+        self.last_call = now
+        self.calls[method] += 1
+
+        if method == "getupdates":
+            offset = int(params.get("offset") or 0)
+            self.pending_updates = [update for update in self.pending_updates if update["update_id"] >= offset]
+            if not self.pending_updates:
+                # Длинный опрос без обновлений: короткая пауза вместо timeout из запроса
+                await asyncio.sleep(min(float(params.get("timeout") or 0), 0.5))
+            result = self.pending_updates
+        elif method == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "LifeIn5Bot"}
+        elif method in MESSAGE_METHODS:
+            chat_id = int(params.get("chat_id", 0))
+            self.sent_by_chat[chat_id] += 1
+            self.first_message = self.first_message or now
+            self.message_ids += 1
+            result = _message(chat_id, int(params.get("message_id", self.message_ids)), params.get("text", ""))
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def stats(self, request):
+        return web.json_response(self.stats_dict())
+
+    def stats_dict(self):
+        return {"calls": dict(self.calls), "chats": len(self.sent_by_chat)}
+
+    def app(self):
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+
+async def start_fake_telegram(host="127.0.0.1", port=8081, latency=0.0):
+    fake = FakeTelegram(latency)
+    runner = web.AppRunner(fake.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return fake, runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фейковый Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    async def serve():
+        await start_fake_telegram(args.host, args.port, args.latency)
+        print(json.dumps({"fake_telegram": f"http://{args.host}:{args.port}"}))
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
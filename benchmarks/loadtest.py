@@ -0,0 +1,273 @@
+# Нагрузочный тест бота без сети: фейковые Bot API и OpenAI, тысячи пользователей проходят
+# /start → анкета → поделиться → счёт → оплата. Результат — JSON для сравнения между коммитами.
+# Запуск из корня репозитория: python -m benchmarks.loadtest --users 2000 --output load.json
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from benchmarks.fake_openai import start_fake_openai
+from benchmarks.fake_telegram import start_fake_telegram
+from benchmarks.replay_updates import free_port
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, share):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else None,
+        "mean": statistics.mean(values) if values else None,
+    }
+
+
+# Время обработки каждого хендлера: внутренняя мидлварь видит выбранный хендлер
+class HandlerTimer:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            name = data["handler"].callback.__name__
+            self.latencies[name].append(time.perf_counter() - started)
+
+
+# Задержка цикла событий: насколько позже запланированного просыпается периодическая задача
+async def monitor_loop_lag(samples, interval=0.05):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - started - interval))
+
+
+class UserSimulator:
+    def __init__(self, main, sample_form, rng):
+        self.main = main
+        self.sample_form = sample_form
+        self.rng = rng
+        self.update_id = 0
+        self.message_id = 0
+
+    def _next_ids(self):
+        self.update_id += 1
+        self.message_id += 1
+        return self.update_id, self.message_id
+
+    def _user(self, chat_id):
+        return {"id": chat_id, "is_bot": False, "first_name": "User", "username": f"user{chat_id}"}
+
+    def _message(self, chat_id, **fields):
+        update_id, message_id = self._next_ids()
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": self._user(chat_id),
+            **fields,
+        }
+        return {"update_id": update_id, "message": message}
+
+    def _callback(self, chat_id, data):
+        update_id, message_id = self._next_ids()
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": f"cb{update_id}",
+                "from": self._user(chat_id),
+                "chat_instance": str(chat_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": "💡",
+                },
+            },
+        }
+
+    def _pre_checkout(self, chat_id):
+        update_id, _ = self._next_ids()
+        return {
+            "update_id": update_id,
+            "pre_checkout_query": {
+                "id": f"pcq{update_id}",
+                "from": self._user(chat_id),
+                "currency": "XTR",
+                "total_amount": 1,
+                "invoice_payload": "buy_3_events",
+            },
+        }
+
+    def _payment(self, chat_id):
+        return self._message(chat_id, successful_payment={
+            "currency": "XTR",
+            "total_amount": 1,
+            "invoice_payload": "buy_3_events",
+            "telegram_payment_charge_id": f"tg{chat_id}-{self.update_id}",
+            "provider_payment_charge_id": f"pr{chat_id}-{self.update_id}",
+        })
+
+    async def feed(self, update):
+        await self.main.dp.feed_raw_update(self.main.bot, update)
+
+    async def run(self, chat_id, think_time):
+        steps = [
+            self._message(chat_id, text="/start", entities=[{"type": "bot_command", "offset": 0, "length": 6}]),
+            self._message(chat_id, text=self.sample_form(self.rng)),
+            self._callback(chat_id, "share_prediction"),
+            self._callback(chat_id, "learn_scenarios"),
+            self._pre_checkout(chat_id),
+            self._payment(chat_id),
+        ]
+        for update in steps:
+            await self.feed(update)
+            if think_time:
+                await asyncio.sleep(self.rng.uniform(0, think_time))
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    telegram_port, openai_port = free_port(), free_port()
+    fake_telegram, telegram_runner = await start_fake_telegram(port=telegram_port, latency=args.telegram_latency)
+    fake_openai, openai_runner = await start_fake_openai(
+        port=openai_port, first_token=args.first_token, token_delay=args.token_delay, tokens=args.tokens,
+        error_rate=args.error_rate
+    )
+
+    # Настройки читаются модулями бота при импорте, поэтому окружение задаётся до него
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    os.chdir(workdir)
+    os.environ.update(
+        BOT_TOKEN="123456:LOADTEST",
+        OPENAI_API_KEY="loadtest",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{openai_port}/v1",
+        TELEGRAM_API_URL=f"http://127.0.0.1:{telegram_port}",
+        TELEGRAM_GLOBAL_RATE=str(args.telegram_rate),
+        TELEGRAM_CHAT_RATE=str(args.telegram_chat_rate),
+        TELEGRAM_CHAT_BURST=str(args.telegram_chat_burst),
+        SPECULATIVE_PREGEN="1" if args.speculative else "0",
+        METRICS_PORT=str(args.metrics_port),
+    )
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import logging
+    import main
+    from benchmarks.bench_prompts import sample_form
+
+    logging.getLogger().setLevel(args.log_level)
+    timer = HandlerTimer()
+    for observer in (main.dp.message, main.dp.callback_query, main.dp.pre_checkout_query):
+        observer.middleware(timer)
+    await main.on_startup()
+
+    lag_samples = []
+    lag_task = asyncio.create_task(monitor_loop_lag(lag_samples))
+    rng = random.Random(args.seed)
+    simulator = UserSimulator(main, sample_form, rng)
+    limiter = asyncio.Semaphore(args.concurrency)
+    flows = []
+    errors = 0
+
+    async def user(chat_id):
+        nonlocal errors
+        async with limiter:
+            started = time.perf_counter()
+            try:
+                await simulator.run(chat_id, args.think_time)
+                flows.append(time.perf_counter() - started)
+            except Exception:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(1_000_000 + index) for index in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    lag_task.cancel()
+    await main.on_shutdown()
+    await main.bot.session.close()
+    await telegram_runner.cleanup()
+    await openai_runner.cleanup()
+
+    updates = simulator.update_id
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "params": vars(args),
+        "users": args.users,
+        "failed_users": errors,
+        "elapsed_seconds": elapsed,
+        "throughput": {
+            "updates_per_second": updates / elapsed,
+            "users_per_second": len(flows) / elapsed,
+        },
+        "user_flow_seconds": summarize(flows),
+        "handlers_seconds": {name: summarize(values) for name, values in sorted(timer.latencies.items())},
+        "event_loop_lag_seconds": summarize(lag_samples),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "telegram_calls": dict(fake_telegram.calls),
+        "openai": fake_openai.stats_dict(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на фейковых Bot API и OpenAI")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=1000, help="сколько пользователей активны одновременно")
+    parser.add_argument("--think-time", type=float, default=0.0, help="пауза пользователя между шагами (сек)")
+    parser.add_argument("--first-token", type=float, default=0.3)
+    parser.add_argument("--token-delay", type=float, default=0.002)
+    parser.add_argument("--tokens", type=int, default=300)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--telegram-latency", type=float, default=0.01)
+    # По умолчанию лимиты Telegram сняты: измеряется сам бот, а не ожидание в очереди отправки
+    parser.add_argument("--telegram-rate", type=float, default=1e6)
+    parser.add_argument("--telegram-chat-rate", type=float, default=1e6)
+    parser.add_argument("--telegram-chat-burst", type=float, default=1e6)
+    parser.add_argument("--speculative", action="store_true")
+    parser.add_argument("--metrics-port", type=int, default=0, help="порт /metrics бота во время теста; 0 — выключен")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="куда записать JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# Проверка масштабирования режима вебхука: бот запускается с N обработчиками против
+# фейкового Bot API, записанные обновления отправляются на вебхук с заданной частотой.
+# Запуск из корня репозитория: python -m benchmarks.replay_updates --workers 1,2,4
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from benchmarks.fake_telegram import start_fake_telegram
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Синтетические /start от разных чатов, если записанных обновлений нет
+def generate_updates(count, chats):
+    for update_id in range(count):
+        chat_id = 100000 + update_id % chats
+        yield {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "User", "username": f"user{chat_id}"},
+                "text": "/start",
+                "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+            },
+        }
+
+
+def load_updates(path):
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+async def wait_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"вебхук не поднялся на порту {port}")
+
+
+async def replay(url, updates, rps, concurrency):
+    interval = 1 / rps if rps else 0
+    limiter = asyncio.Semaphore(concurrency)
+    async with aiohttp.ClientSession() as session:
+        async def post(update):
+            async with limiter:
+                async with session.post(url, json=update) as response:
+                    response.raise_for_status()
+
+        started = time.monotonic()
+        tasks = []
+        for index, update in enumerate(updates):
+            delay = started + index * interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(post(update)))
+        await asyncio.gather(*tasks)
+        return time.monotonic() - started
+
+
+async def run_once(workers, updates, args):
+    telegram_port, webhook_port = free_port(), free_port()
+    fake, runner = await start_fake_telegram(port=telegram_port)
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(
+            os.environ,
+            BOT_TOKEN="123456:REPLAY",
+            OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "replay"),
+            BOT_MODE="webhook",
+            WEBHOOK_WORKERS=str(workers),
+            WEBHOOK_PORT=str(webhook_port),
+            WEBHOOK_HOST="127.0.0.1",
+            WEBHOOK_URL="",
+            TELEGRAM_API_URL=f"http://127.0.0.1:{telegram_port}",
+        )
+        # Процесс запускается асинхронно: фейковый Bot API работает в этом же цикле событий
+        bot_process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(ROOT, "main.py"), cwd=workdir, env=env,
+            stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL
+        )
+        try:
+            await wait_port(webhook_port)
+            # Даём обработчикам время импортировать бота
+            await asyncio.sleep(args.warmup)
+            posted = await replay(f"http://127.0.0.1:{webhook_port}/webhook", updates, args.rps, args.concurrency)
+            # Ждём, пока обработчики перестанут обращаться к Bot API
+            while time.monotonic() - (fake.last_call or 0) < args.idle:
+                await asyncio.sleep(0.1)
+        finally:
+            bot_process.send_signal(signal.SIGTERM)
+            await asyncio.wait_for(bot_process.wait(), 60)
+            await runner.cleanup()
+
+    calls = sum(count for method, count in fake.calls.items() if method != "getme")
+    handled_for = (fake.last_call - fake.first_call) if fake.first_call else 0.0
+    return {
+        "workers": workers,
+        "updates": len(updates),
+        "post_seconds": round(posted, 3),
+        "bot_api_calls": calls,
+        "processing_seconds": round(handled_for, 3),
+        "bot_api_calls_per_second": round(calls / handled_for, 1) if handled_for else None,
+        "calls": dict(fake.calls),
+    }
+
+
+async def main_async(args):
+    updates = load_updates(args.updates_file) if args.updates_file else list(generate_updates(args.updates, args.chats))
+    results = []
+    for workers in map(int, args.workers.split(",")):
+        result = await run_once(workers, updates, args)
+        results.append(result)
+        print(json.dumps(result, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение обновлений на вебхук с разным числом обработчиков")
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--updates-file", help="JSONL с записанными обновлениями Telegram")
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--rps", type=float, default=0, help="0 — без ограничения")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--idle", type=float, default=2.0)
+    parser.add_argument("--output")
+    parser.add_argument("--verbose", action="store_true")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
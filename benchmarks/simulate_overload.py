@@ -0,0 +1,163 @@
+# Симуляция перегрузки: поток бесплатных прогнозов сильнее пропускной способности OpenAI плюс платные продолжения.
+# Сравнивает работу без адаптивной деградации и с ней: задержку до первого текста, длину ответов,
+# отложенные запросы и тех, кто не дождался ответа. Ожидание — до первого текста для бесплатных (поток)
+# и до полного ответа для платных.
+# Запуск из корня репозитория: python -m benchmarks.simulate_overload
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import time
+from collections import Counter
+
+from benchmarks.fake_openai import start_fake_openai
+from benchmarks.replay_updates import free_port
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class Outcome:
+    def __init__(self):
+        self.first_text = []
+        self.words = []
+        self.deferred = 0
+        self.timed_out = 0
+        self.failed = 0
+
+
+async def free_user(gpt, form, outcome, patience):
+    from load_shedding import Overloaded
+
+    started = time.monotonic()
+    words = 0
+
+    async def read_stream():
+        nonlocal words
+        async for chunk in gpt.stream_prediction(form, use_cache=False):
+            if not words:
+                outcome.first_text.append(time.monotonic() - started)
+            words += len(chunk.split())
+
+    try:
+        await asyncio.wait_for(read_stream(), patience)
+    except Overloaded:
+        outcome.deferred += 1
+        return
+    except asyncio.TimeoutError:
+        outcome.timed_out += 1
+        return
+    except Exception:
+        outcome.failed += 1
+        return
+    outcome.words.append(words)
+
+
+async def paid_user(gpt, form, outcome, patience):
+    from scheduler import PRIORITY_PAID
+
+    started = time.monotonic()
+    try:
+        result = await asyncio.wait_for(gpt.generate_prediction(
+            form, future_mode=True, previous_response="Предыдущий прогноз.", use_cache=False, priority=PRIORITY_PAID
+        ), patience)
+    except asyncio.TimeoutError:
+        outcome.timed_out += 1
+        return
+    except Exception:
+        outcome.failed += 1
+        return
+    outcome.first_text.append(time.monotonic() - started)
+    outcome.words.append(len(result.split()))
+
+
+async def run_scenario(gpt, shedder, sample_form, args, shedding):
+    shedder.enabled = shedding
+    shedder.level = 0
+    shedder._latency_at = 0.0
+    rng = random.Random(args.seed)
+    free, paid = Outcome(), Outcome()
+    levels = Counter()
+    tasks = []
+
+    async def sample_levels():
+        while True:
+            levels[shedder.current_level()] += 1
+            await asyncio.sleep(0.25)
+
+    sampler = asyncio.create_task(sample_levels())
+    started = time.monotonic()
+    while time.monotonic() - started < args.duration:
+        if rng.random() < args.paid_share:
+            tasks.append(asyncio.create_task(paid_user(gpt, sample_form(rng), paid, args.patience)))
+        else:
+            tasks.append(asyncio.create_task(free_user(gpt, sample_form(rng), free, args.patience)))
+        await asyncio.sleep(rng.expovariate(args.rate))
+    await asyncio.gather(*tasks)
+    sampler.cancel()
+
+    total_samples = sum(levels.values()) or 1
+    print(f"\n{'с деградацией' if shedding else 'без деградации'}: {len(tasks)} запросов за {args.duration:.0f} с")
+    print(f"{'':>12} {'ответов':>8} {'p50 ожидания':>13} {'p95 ожидания':>13} {'слов в ответе':>14} "
+          f"{'отложено':>9} {'не дождались':>13} {'ошибок':>7}")
+    for name, outcome in (("бесплатные", free), ("платные", paid)):
+        print(
+            f"{name:>12} {len(outcome.words):>8} {percentile(outcome.first_text, 0.5):>13.1f} "
+            f"{percentile(outcome.first_text, 0.95):>13.1f} "
+            f"{statistics.fmean(outcome.words) if outcome.words else 0:>14.0f} "
+            f"{outcome.deferred:>9} {outcome.timed_out:>13} {outcome.failed:>7}"
+        )
+    print("время на уровнях: " + ", ".join(
+        f"{level}: {count / total_samples:.0%}" for level, count in sorted(levels.items())
+    ))
+
+
+async def run(args):
+    logging.basicConfig(level=logging.ERROR)
+    # Не дождавшийся пользователь обрывает поток, фейковый сервер пишет в закрытое соединение — это ожидаемо
+    logging.getLogger("aiohttp.server").setLevel(logging.CRITICAL)
+    port = free_port()
+    _, runner = await start_fake_openai(
+        port=port, first_token=args.first_token, token_delay=args.token_delay, tokens=args.tokens
+    )
+    # Настройки читаются при импорте, поэтому окружение задаётся до него
+    os.environ.update(
+        OPENAI_API_KEY="overload",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{port}/v1",
+        MAX_CONCURRENT_LLM=str(args.slots),
+        SHED_COOLDOWN=str(args.cooldown),
+        OPENAI_DEADLINE=str(args.patience * 2),
+    )
+    import gpt
+    from benchmarks.bench_prompts import sample_form
+    from load_shedding import load_shedder
+
+    for shedding in (False, True):
+        await run_scenario(gpt, load_shedder, sample_form, args, shedding)
+    await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перегрузка OpenAI с адаптивной деградацией и без неё")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--rate", type=float, default=4.0, help="новых запросов в секунду")
+    parser.add_argument("--paid-share", type=float, default=0.1)
+    parser.add_argument("--slots", type=int, default=10, help="MAX_CONCURRENT_LLM")
+    parser.add_argument("--patience", type=float, default=30, help="сколько пользователь ждёт ответа (сек)")
+    parser.add_argument("--first-token", type=float, default=0.5)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--tokens", type=int, default=1000)
+    parser.add_argument("--cooldown", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
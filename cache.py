@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+
+# Время жизни записи кэша прогнозов (сек)
+CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "86400"))
+# Сколько памяти могут занимать записи кэша (байт)
+CACHE_MAX_BYTES = int(os.getenv("PREDICTION_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Каталог дискового уровня кэша; пусто — только память
+CACHE_DIR = os.getenv("PREDICTION_CACHE_DIR", "")
+# Сколько места может занимать дисковый уровень (байт)
+CACHE_DISK_MAX_BYTES = int(os.getenv("PREDICTION_CACHE_DISK_MAX_BYTES", str(256 * 1024 * 1024)))
+# Как часто дисковый уровень очищается от просроченных и лишних файлов (сек)
+CACHE_SWEEP_INTERVAL = float(os.getenv("PREDICTION_CACHE_SWEEP_INTERVAL", "600"))
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_SPACE_RE = re.compile(r"\s+")
+_FIELD_RE = re.compile(r"^([^:]+?)\s*:\s*(.*)$")
+
+# Нормализация анкеты: без HTML, регистра и лишних пробелов, поля в виде пар (вопрос, ответ)
+def normalize_questionnaire(text):
+    fields = []
+    for line in _TAG_RE.sub(" ", text or "").casefold().splitlines():
+        line = _SPACE_RE.sub(" ", line).strip()
+        if not line:
+            continue
+        match = _FIELD_RE.match(line)
+        fields.append([match[1], match[2]] if match else ["", line])
+    return sorted(fields)
+
+# Ключ кэша: базовый прогноз и продолжение (future_mode) никогда не пересекаются
+def make_key(user_input, future_mode=False, previous_response=None):
+    payload = {"mode": "future" if future_mode else "base", "fields": normalize_questionnaire(user_input)}
+    if future_mode:
+        payload["previous"] = _SPACE_RE.sub(" ", previous_response or "").strip()
+    raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class PredictionCache:
+    def __init__(self, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES, directory=CACHE_DIR,
+                 disk_max_bytes=CACHE_DISK_MAX_BYTES, sweep_interval=CACHE_SWEEP_INTERVAL):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0.0
+        self._sweeping = False
+        self.disk_bytes = 0
+        self.disk_evictions = 0
+        self._entries = OrderedDict()  # {key: (created, value, size)}
+        self.size_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _remember(self, key, created, value):
+        self._forget(key)
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        self._entries[key] = (created, value, size)
+        self.size_bytes += size
+        # Вытесняем самые давно использованные записи, пока не уложимся в лимит
+        while self.size_bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self.size_bytes -= evicted_size
+            self.evictions += 1
+
+    def _forget(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= entry[2]
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read_disk(self, key):
+        try:
+            with open(self._path(key), mode="r", encoding="utf-8") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry["created"] > self.ttl:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def _write_disk(self, key, created, value):
+        tmp_path = self._path(key) + ".tmp"
+        with open(tmp_path, mode="w", encoding="utf-8") as file:
+            json.dump({"created": created, "value": value}, file, ensure_ascii=False)
+        os.replace(tmp_path, self._path(key))
+
+    # Удаляет просроченные файлы, затем самые старые, пока дисковый уровень не уложится в лимит.
+    # Время записи берётся из mtime файла, чтобы не читать каждый файл целиком.
+    def _sweep_disk(self):
+        now = time.time()
+        files = []
+        removed = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith((".json", ".tmp")):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                # Недописанные .tmp остаются только после падения процесса
+                expired = now - stat.st_mtime > (self.ttl if entry.name.endswith(".json") else 60)
+                if expired:
+                    try:
+                        os.remove(entry.path)
+                        removed += 1
+                    except OSError:
+                        pass
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        files.sort()
+        for _, size, path in files:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return total, removed
+
+    async def _maybe_sweep(self):
+        if self._sweeping or time.monotonic() - self._last_sweep < self.sweep_interval:
+            return
+        self._sweeping = True
+        try:
+            self.disk_bytes, removed = await asyncio.to_thread(self._sweep_disk)
+            self.disk_evictions += removed
+        except OSError as e:
+            logging.warning("Не удалось очистить дисковый кэш прогнозов: %s", e)
+        finally:
+            self._last_sweep = time.monotonic()
+            self._sweeping = False
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            if time.time() - entry[0] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._forget(key)
+        if self.directory:
+            disk_entry = await asyncio.to_thread(self._read_disk, key)
+            if disk_entry is not None:
+                self._remember(key, disk_entry["created"], disk_entry["value"])
+                self.hits += 1
+                self.disk_hits += 1
+                return disk_entry["value"]
+        self.misses += 1
+        return None
+
+    async def put(self, key, value):
+        created = time.time()
+        self._remember(key, created, value)
+        if self.directory:
+            await asyncio.to_thread(self._write_disk, key, created, value)
+            await self._maybe_sweep()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "size_bytes": self.size_bytes,
+            "disk_bytes": self.disk_bytes,
+            "disk_evictions": self.disk_evictions,
+        }
+
+prediction_cache = PredictionCache()
@@ -1,46 +1,192 @@
+import asyncio
+import logging
 import os
-from openai import AsyncOpenAI
-
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-async def generate_prediction(user_input, future_mode=False, previous_response=None):
-    prompt = user_input
-    if future_mode and previous_response:
-        prompt += (
-            f"\n\nНа основе предыдущего прогноза:\n{previous_response}\n"
-            "Теперь покажи три события, которые меня ждут, если я не выйду из жизненного сценария, "
-            "согласно транзактного анализа, какие у них будут последствия, и как они отразятся на мне и моем здоровье? "
-            "Каждый пункт должен быть детализированным, содержать не менее 4-5 предложений и описывать конкретные изменения в моей жизни. "
-        )
-    else:
-        prompt += (
-            "\n\nНа основе этих данных создай детальное описание моей жизни через 5 лет. "
-            "Учти следующие аспекты: карьера, здоровье, семейная жизнь, хобби, финансы, социальные связи. "
-            "Опиши, как экономика и политика моей страны повлияют на мою жизнь. "
-            "Структурируй ответ в виде нумерованного списка с 3-5 пунктами, используя формат '1.', '2.', '3.' и т.д. "
-            "(например: '1. Текст', '2. Текст', '3. Текст'). Не используй звёздочки (*). "
-            "Каждый пункт должен быть детализированным, содержать не менее 4-5 предложений и описывать конкретные изменения в моей жизни. "
-            "Сделай описание живым, с примерами и деталями, чтобы оно выглядело как реальная картина моей будущей жизни."
-            "🕰 Твоя жизнь через 5 лет (тебе [возраст] лет):, 📍 Общий фон, 👔 Работа, 🧠 Психологическое состояние, "
-            "🏡 Личная жизнь, 🩺 Здоровье, 🎣 Интересы, 📌 Заключение:, 💡 Возможные векторы поворота:. "
-            "Каждый раздел должен быть детализированным и содержать не менее 3-4 предложений."       
-        )
-    
-    response = await client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "Представь, что ты опытный психолог с 30-летним стажем, который умеет прогнозировать будущее человека. "
-                    "Учитывай жизненный сценарий человека, условия экономики и политики государства, в котором он живет, его возраст "
-                    "и общий контекст его жизни. Проанализируй следующие данные обо мне и создай реалистичное, детализированное описание моей жизни."
-                )
-            },
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=1000,  # Оставляем 1500 для большей детализации
+import threading
+import time
+from cache import make_key, prediction_cache
+from llm_policy import ATTEMPT_TIMEOUT, PRIMARY_MODEL, call_with_policy
+from llm_usage import record_usage
+from load_shedding import load_shedder, max_tokens_for
+from metrics import LLM_SECONDS
+from prompts import build_messages, compact_input, prompt_mode
+from scheduler import MAX_CONCURRENT_LLM, PRIORITY_FREE, llm_scheduler
+
+# Пул соединений к OpenAI: с запасом на дублирующие запросы, соединения переиспользуются между запросами
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", str(MAX_CONCURRENT_LLM * 2)))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+# Прогрев при запуске открывает соединение к API запросом списка моделей; "0" — только создать клиент
+OPENAI_WARMUP_CONNECT = os.getenv("OPENAI_WARMUP_CONNECT", "1") == "1"
+
+_client = None
+_client_lock = threading.Lock()
+
+# Клиент создаётся при первом обращении: импорт openai занимает заметную часть запуска,
+# поэтому бот сначала начинает принимать обновления, а warm_up готовит клиент в фоне.
+# Повторы и таймауты задаёт llm_policy, встроенные повторы клиента отключены.
+def get_client():
+    global _client
+    if _client is not None:
+        return _client
+    with _client_lock:
+        if _client is None:
+            import httpx
+            from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+            _client = AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                timeout=httpx.Timeout(ATTEMPT_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+                max_retries=0,
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=OPENAI_MAX_CONNECTIONS,
+                        max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+                    ),
+                    timeout=httpx.Timeout(ATTEMPT_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+                ),
+            )
+    return _client
+
+# Прогрев при запуске: импорт и создание клиента в отдельном потоке, чтобы не останавливать цикл событий,
+# затем соединение к API, чтобы первый прогноз не ждал TCP и TLS
+async def warm_up():
+    started = time.monotonic()
+    client = await asyncio.to_thread(get_client)
+    if OPENAI_WARMUP_CONNECT:
+        try:
+            await client.models.list(timeout=OPENAI_CONNECT_TIMEOUT)
+        except Exception as e:
+            # Ошибка ответа не мешает: соединение уже открыто, а недоступный API проявится в запросах
+            logging.info("Прогрев соединения к OpenAI: %s: %s", type(e).__name__, e)
+    logging.info("Клиент OpenAI готов за %.2f с", time.monotonic() - started)
+
+# level — уровень деградации бесплатного прогноза: короче шаблон и max_tokens
+def _request_params(user_input, future_mode, previous_response, level=0):
+    return dict(
+        model=PRIMARY_MODEL,
+        messages=build_messages(user_input, future_mode, previous_response, level),
+        max_tokens=max_tokens_for(level),  # 1000 на уровне 0
         temperature=0.7,
     )
-    
-    return response.choices[0].message.content
+
+# Бесплатный базовый прогноз можно сократить или отложить под нагрузкой, платный — нет
+def _is_free(future_mode, previous_response, priority):
+    return priority == PRIORITY_FREE and prompt_mode(future_mode, previous_response) == "base"
+
+# use_cache=False — запросить новый прогноз в обход кэша.
+# Все запросы к OpenAI проходят через llm_scheduler: priority задаёт место в очереди,
+# on_queue(position) вызывается, если ожидание затянулось, on_usage(usage) — после ответа модели.
+# При перегрузке бесплатный запрос получает load_shedding.Overloaded вместо ожидания в очереди.
+async def generate_prediction(user_input, future_mode=False, previous_response=None, use_cache=True,
+                              priority=PRIORITY_FREE, on_queue=None, on_usage=None):
+    user_input = compact_input(user_input)
+    cache_key = make_key(user_input, future_mode, previous_response)
+    if use_cache:
+        cached = await prediction_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    free = _is_free(future_mode, previous_response, priority)
+    level = load_shedder.admit(free)
+    admitted = time.monotonic()
+    params = _request_params(user_input, future_mode, previous_response, level)
+    async with llm_scheduler.slot(priority, on_queue):
+        started = time.monotonic()
+        response = await call_with_policy(
+            lambda model: get_client().chat.completions.create(**{**params, "model": model}),
+            on_discard=_discard_response,
+        )
+        latency = time.monotonic() - started
+        if free:
+            load_shedder.observe(time.monotonic() - admitted)
+        record_usage(prompt_mode(future_mode, previous_response), response.usage, latency)
+        LLM_SECONDS.observe(latency, prompt_mode(future_mode, previous_response))
+    if on_usage is not None:
+        on_usage(response.usage)
+
+    result = response.choices[0].message.content
+    # Сокращённый ответ не кэшируется, чтобы после спада нагрузки анкета получила полный прогноз
+    if result and not level:
+        await prediction_cache.put(cache_key, result)
+    return result
+
+# Ответ проигравшего дублирующего запроса: токены оплачены, учитываем их отдельно
+async def _discard_response(response):
+    record_usage("hedge", response.usage, 0.0)
+
+# Попытка потокового запроса — до первого фрагмента с текстом: задержку до первого токена
+# покрывают таймаут, повторы и дублирование, а начатый вывод уже не повторяется
+async def _open_stream(params, model):
+    stream = await get_client().chat.completions.create(
+        **{**params, "model": model},
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    received = []
+    try:
+        while True:
+            try:
+                chunk = await stream.__anext__()
+            except StopAsyncIteration:
+                break
+            received.append(chunk)
+            if chunk.choices and chunk.choices[0].delta.content:
+                break
+    except BaseException:
+        await stream.close()
+        raise
+    return stream, received
+
+async def _close_stream(opened):
+    await opened[0].close()
+
+async def _chunks(stream, received):
+    for chunk in received:
+        yield chunk
+    async for chunk in stream:
+        yield chunk
+
+# Потоковый режим: фрагменты текста отдаются по мере генерации
+async def stream_prediction(user_input, future_mode=False, previous_response=None, use_cache=True,
+                            priority=PRIORITY_FREE, on_queue=None):
+    user_input = compact_input(user_input)
+    cache_key = make_key(user_input, future_mode, previous_response)
+    if use_cache:
+        cached = await prediction_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    usage = None
+    free = _is_free(future_mode, previous_response, priority)
+    level = load_shedder.admit(free)
+    admitted = time.monotonic()
+    # Слот занят, пока идёт поток
+    async with llm_scheduler.slot(priority, on_queue):
+        started = time.monotonic()
+        params = _request_params(user_input, future_mode, previous_response, level)
+        stream, received = await call_with_policy(
+            lambda model: _open_stream(params, model), on_discard=_close_stream, series="stream"
+        )
+        if free:
+            # Для потока важна задержка до первого текста
+            load_shedder.observe(time.monotonic() - admitted)
+        async for chunk in _chunks(stream, received):
+            # Последний фрагмент потока без choices содержит usage
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+        latency = time.monotonic() - started
+        record_usage(prompt_mode(future_mode, previous_response), usage, latency)
+        LLM_SECONDS.observe(latency, prompt_mode(future_mode, previous_response))
+
+    result = "".join(parts)
+    if result and not level:
+        await prediction_cache.put(cache_key, result)
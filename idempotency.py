@@ -0,0 +1,119 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+
+# Сколько помнить завершённую операцию, чтобы не повторять её (сек)
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "60"))
+# Оплаты помним дольше: Telegram может доставить successful_payment повторно
+PAYMENT_IDEMPOTENCY_TTL = float(os.getenv("PAYMENT_IDEMPOTENCY_TTL", str(7 * 24 * 3600)))
+
+class _Flight:
+    __slots__ = ("future", "expires")
+
+    def __init__(self, future):
+        self.future = future
+        self.expires = float("inf")  # пока операция выполняется, ключ не истекает
+
+# Одна операция на ключ: повторные запросы ждут результата уже идущей или недавно завершённой
+class SingleFlight:
+    def __init__(self, ttl=IDEMPOTENCY_TTL):
+        self.ttl = ttl
+        self._flights = OrderedDict()
+        self.started = 0
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self._flights)
+
+    def _sweep(self, now):
+        while self._flights:
+            key, flight = next(iter(self._flights.items()))
+            if flight.expires > now:
+                break
+            del self._flights[key]
+
+    # Возвращает (результат, True), если операция выполнена этим вызовом,
+    # и (результат, False) для повтора; если исходная операция упала, повтор получит None.
+    # ttl — сколько помнить завершённую операцию, если не как у экземпляра; 0 — только пока она выполняется.
+    async def run(self, key, make_operation, ttl=None):
+        now = time.monotonic()
+        self._sweep(now)
+        flight = self._flights.get(key)
+        if flight is not None and flight.expires > now:
+            self.duplicates += 1
+            try:
+                return await asyncio.shield(flight.future), False
+            except Exception:
+                return None, False
+
+        future = asyncio.get_running_loop().create_future()
+        flight = self._flights[key] = _Flight(future)
+        self._flights.move_to_end(key)
+        self.started += 1
+        try:
+            result = await make_operation()
+        except BaseException as e:
+            # Неудачную операцию можно повторить сразу
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                future.exception()  # ошибку получит вызывающий, ожидающим повторам она не нужна в логе
+            else:
+                future.cancel()
+            raise
+        future.set_result(result)
+        ttl = self.ttl if ttl is None else ttl
+        if self._flights.get(key) is flight:
+            if ttl <= 0:
+                del self._flights[key]
+            else:
+                flight.expires = time.monotonic() + ttl
+                # Завершённые ключи — в конец в порядке завершения, чтобы _sweep шёл от самых старых
+                self._flights.move_to_end(key)
+        return result, True
+
+    # Повтор можно будет выполнить сразу, не дожидаясь TTL (например, если операция отложена)
+    def forget(self, key):
+        self._flights.pop(key, None)
+
+    def stats(self):
+        return {"keys": len(self._flights), "started": self.started, "duplicates": self.duplicates}
+
+single_flight = SingleFlight()
+# Отдельный экземпляр с длинным TTL, чтобы ключи оплат не задерживали очистку коротких
+payment_flights = SingleFlight(PAYMENT_IDEMPOTENCY_TTL)
+
+# Ключ для текстового сообщения: повторная отправка того же текста не запускает обработку заново
+def message_key(message):
+    text = " ".join((message.text or "").casefold().split())
+    return ("message", message.chat.id, hashlib.sha256(text.encode("utf-8")).hexdigest())
+
+# Ключ нажатия: одна и та же кнопка одного сообщения. Такие же кнопки под новым прогнозом — уже другая операция.
+def callback_key(callback_query):
+    message = callback_query.message
+    return ("callback", callback_query.from_user.id, message.message_id if message else None, callback_query.data)
+
+def payment_key(message):
+    return ("payment", message.successful_payment.telegram_payment_charge_id)
+
+# Декоратор хендлера: key(event) — ключ операции, on_duplicate(event) — ответ на повтор,
+# ttl — сколько помнить завершённую операцию (см. SingleFlight.run).
+# Хендлер принимает только событие: aiogram передаёт аргументы по сигнатуре обёртки.
+def deduplicate(key, flights=single_flight, on_duplicate=None, ttl=None):
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(event):
+            operation_key = key(event)
+            _, fresh = await flights.run(operation_key, lambda: handler(event), ttl)
+            if not fresh:
+                logging.info("Повторный запрос %s проигнорирован, результат уже получен", operation_key[0],
+                             extra={"category": "duplicate"})
+                if on_duplicate is not None:
+                    await on_duplicate(event)
+        return wrapper
+    return decorator
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+
+from metrics import LLM_ATTEMPT_SECONDS
+from scheduler import llm_scheduler
+
+# Основная и запасная модели; пустая запасная — повторять основной
+PRIMARY_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+FALLBACK_MODEL = os.getenv("OPENAI_FALLBACK_MODEL", "gpt-4.1-mini")
+# Предел одной попытки и всего запроса вместе с повторами (сек)
+ATTEMPT_TIMEOUT = float(os.getenv("OPENAI_ATTEMPT_TIMEOUT", "25"))
+REQUEST_DEADLINE = float(os.getenv("OPENAI_DEADLINE", "45"))
+# Повторы при временных ошибках: пауза случайна в [0, RETRY_BASE_DELAY * 2^попытка]
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+RETRY_BASE_DELAY = float(os.getenv("OPENAI_RETRY_BASE_DELAY", "0.5"))
+# Дублирующий запрос, если ответ не пришёл за p95 недавних задержек (но не раньше HEDGE_MIN_DELAY)
+HEDGE_ENABLED = os.getenv("OPENAI_HEDGE", "0") == "1"
+HEDGE_QUANTILE = float(os.getenv("OPENAI_HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_DELAY = float(os.getenv("OPENAI_HEDGE_MIN_DELAY", "1.0"))
+# Пока замеров меньше, задержка неизвестна и дублирования нет
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+_transient_errors = None
+
+# Ошибки, после которых есть смысл повторить запрос. openai импортируется при первом обращении,
+# к этому моменту он уже загружен клиентом из gpt.
+def transient_errors():
+    global _transient_errors
+    if _transient_errors is None:
+        import openai
+
+        _transient_errors = (
+            asyncio.TimeoutError,
+            openai.APIConnectionError,  # включая APITimeoutError
+            openai.RateLimitError,
+            openai.InternalServerError,
+        )
+    return _transient_errors
+
+# Скользящее окно удачных задержек для выбора момента дублирования. Окна раздельны по (модель, серия):
+# у потока замеряется время до первого текста, у обычного запроса — до полного ответа, и смешивать их нельзя.
+class LatencyTracker:
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self._samples = {}
+
+    def observe(self, key, latency):
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=self.window)
+        samples.append(latency)
+
+    def quantile(self, key, q):
+        samples = self._samples.get(key)
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def hedge_delay(self, key):
+        value = self.quantile(key, HEDGE_QUANTILE)
+        return None if value is None else max(value, HEDGE_MIN_DELAY)
+
+latency_tracker = LatencyTracker()
+
+def backoff_delay(attempt):
+    return random.uniform(0, RETRY_BASE_DELAY * 2 ** attempt)
+
+# Одна попытка с возможным дублированием: возвращает первый удачный результат.
+# Проигравший запрос отменяется; если он всё же успел завершиться, результат уходит в on_discard.
+async def _hedged_attempt(make_call, model, kind, timeout, on_discard, series):
+    started = time.monotonic()
+    tasks = {asyncio.create_task(make_call(model)): (kind, started)}
+    hedge_at = None
+    if HEDGE_ENABLED and llm_scheduler.queue_depth() == 0:
+        # При очереди к OpenAI лишние запросы только отнимут слоты у других пользователей
+        delay = latency_tracker.hedge_delay((model, series))
+        if delay is not None and delay < timeout:
+            hedge_at = started + delay
+    deadline = started + timeout
+    winner = None
+    error = None
+    try:
+        while tasks:
+            now = time.monotonic()
+            wake_at = min(deadline, hedge_at) if hedge_at is not None else deadline
+            done, _ = await asyncio.wait(tasks, timeout=max(wake_at - now, 0), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task_kind, task_started = tasks.pop(task)
+                latency = time.monotonic() - task_started
+                if task.exception() is None:
+                    LLM_ATTEMPT_SECONDS.observe(latency, model, task_kind, "ok")
+                    latency_tracker.observe((model, series), latency)
+                    if winner is None:
+                        winner = task.result()
+                    elif on_discard is not None:
+                        await on_discard(task.result())
+                else:
+                    LLM_ATTEMPT_SECONDS.observe(latency, model, task_kind, "error")
+                    error = task.exception()
+            if winner is not None:
+                return winner
+            if done:
+                continue
+            if hedge_at is not None and time.monotonic() >= hedge_at:
+                logging.info("Нет ответа %s за %.2f с, отправляем дублирующий запрос", model, hedge_at - started)
+                tasks[asyncio.create_task(make_call(model))] = ("hedge", time.monotonic())
+                hedge_at = None
+            elif time.monotonic() >= deadline:
+                raise asyncio.TimeoutError(f"{model}: нет ответа за {timeout:.1f} с")
+        raise error
+    finally:
+        outcome = "lost" if winner is not None else "timeout"
+        for task, (task_kind, task_started) in tasks.items():
+            task.cancel()
+            LLM_ATTEMPT_SECONDS.observe(time.monotonic() - task_started, model, task_kind, outcome)
+        for task in tasks:
+            try:
+                result = await task
+            except BaseException:
+                continue
+            if on_discard is not None:
+                await on_discard(result)
+
+# Запрос к OpenAI с дедлайном, повторами с джиттером и переходом на запасную модель.
+# make_call(model) — корутина одной попытки; запасная модель берётся для последней попытки
+# или сразу после таймаута основной. series — что измеряет попытка: "full" — полный ответ,
+# "stream" — время до первого текста; от неё зависит окно задержек для дублирования.
+async def call_with_policy(make_call, on_discard=None, series="full"):
+    deadline = time.monotonic() + REQUEST_DEADLINE
+    error = None
+    for attempt in range(MAX_RETRIES + 1):
+        use_fallback = FALLBACK_MODEL and attempt > 0 and (
+            attempt == MAX_RETRIES or isinstance(error, asyncio.TimeoutError)
+        )
+        model = FALLBACK_MODEL if use_fallback else PRIMARY_MODEL
+        kind = "primary" if attempt == 0 else "fallback" if use_fallback else "retry"
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            return await _hedged_attempt(make_call, model, kind, min(ATTEMPT_TIMEOUT, remaining), on_discard, series)
+        except transient_errors() as e:
+            error = e
+            logging.warning("Попытка %d запроса к %s не удалась: %s: %s", attempt + 1, model, type(e).__name__, e)
+        if attempt < MAX_RETRIES:
+            await asyncio.sleep(min(backoff_delay(attempt), max(deadline - time.monotonic(), 0)))
+    raise error or asyncio.TimeoutError("истёк общий дедлайн запроса к OpenAI")
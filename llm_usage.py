@@ -0,0 +1,55 @@
+import os
+
+# Цены gpt-4o-mini, $ за 1M токенов: обычный вход, вход из кэша, выход
+PRICE_INPUT = float(os.getenv("LLM_PRICE_INPUT", "0.15"))
+PRICE_CACHED_INPUT = float(os.getenv("LLM_PRICE_CACHED_INPUT", "0.075"))
+PRICE_OUTPUT = float(os.getenv("LLM_PRICE_OUTPUT", "0.60"))
+
+# Накопленный расход токенов по режимам ("base", "future")
+_totals = {}
+
+def _mode_totals(mode):
+    totals = _totals.get(mode)
+    if totals is None:
+        totals = _totals[mode] = {
+            "calls": 0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,
+            "completion_tokens": 0,
+            "latency": 0.0,
+        }
+    return totals
+
+# Учёт одного ответа OpenAI: usage из ответа (или последнего фрагмента потока) и время запроса
+def record_usage(mode, usage, latency):
+    totals = _mode_totals(mode)
+    totals["calls"] += 1
+    totals["latency"] += latency
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    totals["prompt_tokens"] += usage.prompt_tokens or 0
+    totals["cached_tokens"] += (getattr(details, "cached_tokens", None) or 0) if details else 0
+    totals["completion_tokens"] += usage.completion_tokens or 0
+
+def _cost(prompt_tokens, cached_tokens, completion_tokens):
+    return (
+        (prompt_tokens - cached_tokens) * PRICE_INPUT
+        + cached_tokens * PRICE_CACHED_INPUT
+        + completion_tokens * PRICE_OUTPUT
+    ) / 1_000_000
+
+# Отчёт по режимам: доля закэшированных входных токенов, средняя стоимость и задержка запроса
+def usage_report():
+    report = {}
+    for mode, totals in _totals.items():
+        calls = totals["calls"] or 1
+        cost = _cost(totals["prompt_tokens"], totals["cached_tokens"], totals["completion_tokens"])
+        report[mode] = {
+            **totals,
+            "cache_hit_ratio": totals["cached_tokens"] / totals["prompt_tokens"] if totals["prompt_tokens"] else 0.0,
+            "cost_usd": cost,
+            "avg_cost_usd": cost / calls,
+            "avg_latency": totals["latency"] / calls,
+        }
+    return report
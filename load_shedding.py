@@ -0,0 +1,102 @@
+import logging
+import os
+import time
+
+from metrics import LLM_DEFERRED, LLM_DEGRADED
+from scheduler import llm_scheduler
+
+# Адаптивное снижение качества бесплатных прогнозов под нагрузкой; "0" — всегда полное качество
+LOAD_SHEDDING = os.getenv("LOAD_SHEDDING", "1") == "1"
+# max_tokens бесплатного прогноза на уровнях 0, 1, 2 (шаблон сокращается вместе с ним)
+LEVEL_MAX_TOKENS = tuple(int(value) for value in os.getenv("SHED_MAX_TOKENS", "1000,600,350").split(","))
+# На этом уровне новые бесплатные запросы откладываются
+SHED_LEVEL = len(LEVEL_MAX_TOKENS)
+# Пороги уровней 1, 2, 3 по нагрузке: (запросы в работе + в очереди) / MAX_CONCURRENT_LLM
+LOAD_THRESHOLDS = tuple(float(value) for value in os.getenv("SHED_LOAD_THRESHOLDS", "0.8,1.5,3").split(","))
+# Пороги уровней 1, 2, 3 по средней недавней задержке бесплатного прогноза вместе с очередью:
+# до первого текста для потока, до ответа для обычного запроса (сек)
+LATENCY_THRESHOLDS = tuple(float(value) for value in os.getenv("SHED_LATENCY_THRESHOLDS", "8,15,30").split(","))
+# Уровень снижается на одну ступень, если нагрузка держится ниже него столько секунд
+SHED_COOLDOWN = float(os.getenv("SHED_COOLDOWN", "15"))
+# Задержка старше этого не учитывается: без новых запросов уровень не залипает (сек)
+LATENCY_MAX_AGE = 60
+LATENCY_EWMA_ALPHA = 0.2
+# Границы подсказки «попробуй через ...» (сек)
+RETRY_AFTER_MIN = 60
+RETRY_AFTER_MAX = 600
+
+# Бесплатный запрос отложен из-за перегрузки; retry_after — через сколько секунд стоит повторить
+class Overloaded(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"перегрузка, повторить через {retry_after:.0f} с")
+        self.retry_after = retry_after
+
+def _threshold_level(value, thresholds):
+    return sum(1 for threshold in thresholds if value >= threshold)
+
+class LoadShedder:
+    def __init__(self, scheduler=llm_scheduler, enabled=LOAD_SHEDDING):
+        self.scheduler = scheduler
+        self.enabled = enabled
+        self.level = 0
+        self._changed_at = time.monotonic()
+        self.latency = 0.0  # экспоненциальное среднее задержки
+        self._latency_at = 0.0
+        self.deferred = 0
+
+    def observe(self, latency):
+        self.latency = latency if not self._latency_at else (
+            LATENCY_EWMA_ALPHA * latency + (1 - LATENCY_EWMA_ALPHA) * self.latency
+        )
+        self._latency_at = time.monotonic()
+
+    def load(self):
+        return (self.scheduler.in_flight + self.scheduler.queue_depth()) / self.scheduler.limit
+
+    def _target_level(self):
+        level = _threshold_level(self.load(), LOAD_THRESHOLDS)
+        if time.monotonic() - self._latency_at <= LATENCY_MAX_AGE:
+            level = max(level, _threshold_level(self.latency, LATENCY_THRESHOLDS))
+        return min(level, SHED_LEVEL)
+
+    # Рост уровня — сразу, снижение — по одной ступени не чаще SHED_COOLDOWN, чтобы не раскачиваться
+    def current_level(self):
+        if not self.enabled:
+            return 0
+        target = self._target_level()
+        now = time.monotonic()
+        if target > self.level or (target < self.level and now - self._changed_at >= SHED_COOLDOWN):
+            new_level = target if target > self.level else self.level - 1
+            logging.warning("Уровень деградации прогнозов: %d → %d (нагрузка %.2f, задержка %.1f с)",
+                            self.level, new_level, self.load(), self.latency)
+            self.level = new_level
+            self._changed_at = now
+        elif target >= self.level:
+            self._changed_at = now
+        return self.level
+
+    # Оценка, когда очередь рассосётся: число «волн» запросов на среднюю задержку
+    def retry_after(self):
+        waves = self.load()
+        return min(max(waves * max(self.latency, 1.0), RETRY_AFTER_MIN), RETRY_AFTER_MAX)
+
+    # Уровень для нового запроса; платные и продолжения всегда получают полное качество
+    def admit(self, free):
+        if not free:
+            return 0
+        level = self.current_level()
+        if level >= SHED_LEVEL:
+            self.deferred += 1
+            LLM_DEFERRED.inc()
+            raise Overloaded(self.retry_after())
+        if level:
+            LLM_DEGRADED.inc(str(level))
+        return level
+
+    def stats(self):
+        return {"level": self.level, "load": self.load(), "latency": self.latency, "deferred": self.deferred}
+
+def max_tokens_for(level):
+    return LEVEL_MAX_TOKENS[level]
+
+load_shedder = LoadShedder()
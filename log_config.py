@@ -0,0 +1,120 @@
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+# Уровень и формат логов: "text" — строки как раньше, "json" — по JSON-объекту на строку
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+# Очередь к потоку записи; при переполнении записи отбрасываются, а не блокируют цикл событий
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Доля сохраняемых записей по категориям частых сообщений: "категория=доля,..."
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "unhandled=0.01,unrecognized_form=0.1")
+
+# Атрибуты LogRecord, которые не относятся к полям из extra
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+def _parse_sampling(value):
+    rates = {}
+    for item in value.replace(" ", "").split(","):
+        if not item:
+            continue
+        category, _, rate = item.partition("=")
+        rates[category] = float(rate)
+    return rates
+
+# Пропускает каждую N-ю запись категории (N = 1 / доля), начиная с первой.
+# Категория задаётся через extra={"category": ...}; в записи остаётся sampled=N — сколько записей она представляет.
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates):
+        super().__init__()
+        self.every = {category: max(1, round(1 / rate)) if rate > 0 else 0 for category, rate in rates.items()}
+        self._counters = {category: itertools.count() for category in self.every}
+        self.dropped = {category: 0 for category in self.every}
+
+    def filter(self, record):
+        category = getattr(record, "category", None)
+        every = self.every.get(category)
+        if every is None or every == 1:
+            return True
+        if every and next(self._counters[category]) % every == 0:
+            record.sampled = every
+            return True
+        self.dropped[category] += 1
+        return False
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            # Шаблон без аргументов: по нему удобно группировать однотипные записи
+            "event": record.msg if isinstance(record.msg, str) else str(record.msg),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+# Постановка в очередь без форматирования: сообщение собирается в потоке записи,
+# а отброшенные фильтрами и выборкой записи не форматируются вовсе
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_listener = None
+_queue_handler = None
+
+# Записи из любых потоков и цикла событий идут в очередь, в stream (по умолчанию stderr) их пишет QueueListener
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT, sampling=LOG_SAMPLING, stream=None):
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(stream or sys.stderr)
+    if log_format == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(TEXT_FORMAT))
+    _queue_handler = _NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _queue_handler.addFilter(SamplingFilter(_parse_sampling(sampling)))
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    # Записи, оставшиеся в очереди, дописываются при выходе
+    atexit.register(stop_logging)
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+# Отброшенные выборкой и при переполнении очереди записи
+def logging_stats():
+    if _queue_handler is None:
+        return {"sampled_out": {}, "queue_full": 0}
+    sampling = next(f for f in _queue_handler.filters if isinstance(f, SamplingFilter))
+    return {"sampled_out": dict(sampling.dropped), "queue_full": _queue_handler.dropped}
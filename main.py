@@ -1,79 +1,155 @@
+import time
+
+# Момент запуска: от него считается время до первого обработанного обновления
+LAUNCHED_AT = time.monotonic()
+
 import logging
 import asyncio
-import time
 from aiogram import Bot, Dispatcher, types
 from aiogram.enums import ParseMode
 from aiogram.filters import CommandStart, Command
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from dotenv import load_dotenv
 import os
-from gpt import generate_prediction
-from analytics import update_analytics_data  # Импортируем функции аналитики
 
+# Переменные из .env нужны модулям ниже уже при импорте
 load_dotenv()
 
+from cache import prediction_cache
+from gpt import generate_prediction, stream_prediction, warm_up
+from idempotency import callback_key, deduplicate, message_key, payment_flights, payment_key, single_flight
+from llm_usage import usage_report
+from log_config import logging_stats, setup_logging
+from load_shedding import Overloaded, load_shedder
+from metrics import Gauge, install_middleware, start_metrics, stop_metrics
+from questionnaire import format_questionnaire, parse_questionnaire
+from rendering import TELEGRAM_MESSAGE_LIMIT, cut_text, is_blank, render_bundle
+from scheduler import PRIORITY_PAID, llm_scheduler
+from sender import outbox
+from sessions import sessions
+from speculative import speculative
+from analytics import format_stats, read_stats, record_event, start_analytics, stop_analytics  # Импортируем функции аналитики
+
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Режим получения обновлений: "polling" или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Адрес Bot API, если используется свой сервер (например, локальный для нагрузочных тестов)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# Telegram id администраторов через запятую: им доступна команда /stats
+ADMIN_IDS = {int(admin_id) for admin_id in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if admin_id}
 
-# Настраиваем логирование
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+# Логи пишет отдельный поток: обработчики только кладут записи в очередь
+setup_logging()
 
 # Создаём бота
-bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+bot = Bot(
+    token=BOT_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None,
+    default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+)
 dp = Dispatcher()
+# Время обработки обновлений и каждого хендлера
+install_middleware(dp, LAUNCHED_AT)
 
-# Хранилище данных в памяти
-user_prompts = {}  # Хранит анкеты пользователей
-user_predictions = {}  # Хранит прогнозы
-processed_callbacks = set()  # Хранит обработанные callback_query_id
-user_analytics = {}  # Хранит аналитику: {chat_id: {"start_count": int, "forecast_count": int, "payment_count": int, "start_time": float}}
-user_start_times = {}  # Хранит время начала сессии: {chat_id: start_time}
-
-# Максимальная длина сообщения в Telegram
-TELEGRAM_MESSAGE_LIMIT = 4096
-
-# Функция для разбиения текста на части
-def split_text(text, limit=TELEGRAM_MESSAGE_LIMIT):
-    parts = []
-    while len(text) > limit:
-        split_pos = text[:limit].rfind('\n')
-        if split_pos == -1:
-            split_pos = text[:limit].rfind(' ')
-            if split_pos == -1:
-                split_pos = limit
-        parts.append(text[:split_pos])
-        text = text[split_pos:].lstrip()
-    if text:
-        parts.append(text)
-    return parts
+# Состояние чатов (анкета, прогноз, аналитика) хранится в sessions: с TTL и лимитом памяти
+
+# Минимальный интервал между правками одного сообщения при потоковом выводе (сек)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+
+# Правка сообщения при потоковом выводе. Ошибка не прерывает вывод: следующая или финальная правка её заменит.
+async def edit_stream_message(chat_id, message, text):
+    try:
+        await outbox.send(chat_id, lambda: message.edit_text(text))
+        return True
+    except TelegramBadRequest as e:
+        logging.warning("Не удалось обновить сообщение при потоковом выводе: %s", e)
+        return False
+
+# Потоковый вывод: текст дописывается в сообщение-заглушку по мере генерации.
+# Правки не чаще STREAM_EDIT_INTERVAL, при превышении лимита продолжение идёт новым сообщением.
+async def render_stream(placeholder, header, chunks):
+    chat_id = placeholder.chat.id
+    text = header
+    shown = placeholder.text
+    last_edit = 0.0
+    result = []
+    async for chunk in chunks:
+        result.append(chunk)
+        text += chunk
+        while len(text) > TELEGRAM_MESSAGE_LIMIT:
+            head, rest = cut_text(text, TELEGRAM_MESSAGE_LIMIT)
+            if is_blank(rest):
+                # За лимитом пока одни пробелы: новое сообщение начнётся, когда придёт текст
+                break
+            if head != shown and await edit_stream_message(chat_id, placeholder, head):
+                shown = head
+            text = rest
+            shown = cut_text(text, TELEGRAM_MESSAGE_LIMIT)[0] if len(text) > TELEGRAM_MESSAGE_LIMIT else text
+            placeholder = await outbox.send(chat_id, lambda message=placeholder, shown=shown: message.answer(shown))
+            last_edit = time.monotonic()
+        visible = cut_text(text, TELEGRAM_MESSAGE_LIMIT)[0] if len(text) > TELEGRAM_MESSAGE_LIMIT else text
+        if visible != shown and time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL:
+            if await edit_stream_message(chat_id, placeholder, visible):
+                shown = visible
+            last_edit = time.monotonic()
+    visible = cut_text(text, TELEGRAM_MESSAGE_LIMIT)[0] if len(text) > TELEGRAM_MESSAGE_LIMIT else text
+    if visible != shown:
+        await outbox.send(chat_id, lambda: placeholder.edit_text(visible))
+    return "".join(result)
+
+# Отправка длинного текста частями через общую очередь отправки; части берутся из отрендеренного прогноза
+async def send_parts(message, text):
+    for part in render_bundle(text).parts:
+        await outbox.send(message.chat.id, lambda part=part: message.answer(part))
+
+# Заранее начинаем генерацию 3 событий, пока пользователь оплачивает счёт
+async def start_speculative(chat_id):
+    session = await sessions.get(chat_id)
+    if session and session.prompt:
+        speculative.start(chat_id, session.prompt, session.prediction)
+
+# Уведомление о месте в очереди, если генерация долго не может начаться
+def queue_notifier(message):
+    async def notify(position):
+        logging.info("chat_id %s ждёт в очереди к OpenAI, позиция %d", message.chat.id, position)
+        text = f"⏳ Сейчас много желающих узнать своё будущее! Ты в очереди: {position}. Прогноз скоро начнётся 😊"
+        try:
+            await outbox.send(message.chat.id, lambda: message.answer(text))
+        except Exception as e:
+            # Уведомление не обязательно: запрос остаётся в очереди, даже если пользователь заблокировал бота
+            logging.warning("Не удалось сообщить chat_id %s место в очереди: %s", message.chat.id, e)
+    return notify
 
 # Функция для обновления аналитики
-async def log_analytics(chat_id, username, start_count=0, forecast_count=0, payment_count=0):
-    if chat_id not in user_analytics:
-        user_analytics[chat_id] = {
-            "start_count": 0,
-            "forecast_count": 0,
-            "payment_count": 0,
-            "start_time": user_start_times.get(chat_id, time.time())
-        }
-    
-    user_analytics[chat_id]["start_count"] += start_count
-    user_analytics[chat_id]["forecast_count"] += forecast_count
-    user_analytics[chat_id]["payment_count"] += payment_count
+async def log_analytics(chat_id, username, start_count=0, forecast_count=0, payment_count=0, invoice_count=0):
+    now = time.time()
+    session = await sessions.get_or_create(chat_id)
+    if session.start_time is None:
+        session.start_time = session.last_time = now
+
+    session.start_count += start_count
+    session.forecast_count += forecast_count
+    session.payment_count += payment_count
     
-    # Вычисляем время использования (в минутах)
-    start_time = user_analytics[chat_id]["start_time"]
-    usage_time = (time.time() - start_time) / 60  # Время в минутах
+    # Время использования с прошлого события (в минутах)
+    usage_time = (now - session.last_time) / 60
+    session.last_time = now
+    await sessions.save(session)
     
-    # Обновляем данные в CSV
-    update_analytics_data(
+    # Событие уходит в журнал аналитики без ожидания записи на диск
+    record_event(
         username=username,
         user_id=chat_id,
-        start_count=user_analytics[chat_id]["start_count"],
-        forecast_count=user_analytics[chat_id]["forecast_count"],
-        payment_count=user_analytics[chat_id]["payment_count"],
-        usage_time=usage_time
+        start_count=start_count,
+        forecast_count=forecast_count,
+        payment_count=payment_count,
+        usage_time=usage_time,
+        invoice_count=invoice_count
     )
 
 @dp.message(CommandStart())
@@ -81,13 +157,15 @@ async def start(message: types.Message):
     chat_id = message.chat.id
     username = message.from_user.username or message.from_user.first_name
     
-    # Сохраняем время начала сессии
-    user_start_times[chat_id] = time.time()
+    # Сохраняем время начала сессии: время между сессиями не считается временем использования
+    session = await sessions.get_or_create(chat_id)
+    session.start_time = session.last_time = time.time()
+    await sessions.save(session)
     
     # Увеличиваем счётчик нажатий /start
     await log_analytics(chat_id, username, start_count=1)
     
-    logging.info(f"Пользователь {chat_id} запустил бота")
+    logging.info("Пользователь %s запустил бота", chat_id)
     await message.answer(
         "🌟 <b>УЗНАЙ, ЧТО ЖДЁТ ТЕБЯ ЧЕРЕЗ 5 ЛЕТ!</b> 🌟\n\n"
         "Я помогу тебе заглянуть в будущее с помощью ИИ! Ответь на несколько вопросов о себе, и я создам подробный прогноз твоей жизни на 5 лет вперёд. А после ты сможешь узнать, что будет, если ничего не изменить, всего за 1 звезду ⭐! Это займёт всего пару минут! 😊\n\n"
@@ -112,40 +190,51 @@ async def start(message: types.Message):
         "<b>На основе этих данных я создам детальное описание моей жизни через 5 лет!</b>"
     )
 
-# Обработчик анкеты
+# Воронка и активность для администраторов
+@dp.message(Command("stats"))
+async def stats(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        logging.warning("Пользователь %s запросил /stats без прав администратора", message.from_user.id)
+        return
+    report = await asyncio.to_thread(read_stats)
+    await send_parts(message, format_stats(report))
+
+# Ответ на ту же анкету, пришедшую ещё раз, пока первая обрабатывалась: к этому моменту ответ уже в чате
+async def answer_duplicate_form(message):
+    await message.answer("Эту анкету я уже получил — ответ на неё выше 👆")
+
+# Обработчик анкеты. Одинаковые сообщения схлопываются только пока первое обрабатывается:
+# после "Попробовать снова" ту же анкету можно прислать сразу, прогноз возьмётся из кэша.
 @dp.message(lambda message: message.text is not None and not message.text.startswith('/'))
+@deduplicate(message_key, on_duplicate=answer_duplicate_form, ttl=0)
 async def handle_filled_form(message: types.Message):
     chat_id = message.chat.id
     username = message.from_user.username or message.from_user.first_name
     
-    # Проверяем, что сообщение содержит ключевые слова анкеты
-    if "Мой возраст" in message.text and "Страна, где я живу" in message.text:
-        logging.info(f"Получена анкета от chat_id {chat_id}")
-        user_prompts[chat_id] = message.text
-        await message.answer("🧠 Анализирую твою жизнь... Это займёт всего несколько секунд! ⏳")
+    # Разбираем анкету: без подсказок шаблона и разметки, с ограничением длины полей
+    questionnaire = parse_questionnaire(message.text)
+    if questionnaire is not None:
+        logging.info("Получена анкета от chat_id %s", chat_id)
+        session = await sessions.get_or_create(chat_id)
+        session.prompt = format_questionnaire(questionnaire)
+        await sessions.save(session)
+        placeholder = await message.answer("🧠 Анализирую твою жизнь... Это займёт всего несколько секунд! ⏳")
         try:
-            result = await generate_prediction(message.text)
-            user_predictions[chat_id] = result
-
-            # Формируем сообщение
-            full_message = (
+            # Прогноз выводится в заглушку по мере генерации
+            header = (
                 "<b>🔮 Твой прогноз на 5 лет вперёд:</b>\n\n"
                 "Вот что ждёт тебя, если ты продолжишь идти текущим путём:\n\n"
-                f"{result}"
             )
-
-            # Разбиваем текст на части, если он слишком длинный
-            message_parts = split_text(full_message, TELEGRAM_MESSAGE_LIMIT)
-
-            # Отправляем каждую часть
-            for part in message_parts:
-                await message.answer(part)
-                await asyncio.sleep(0.5)
+            result = await render_stream(placeholder, header, stream_prediction(questionnaire, on_queue=queue_notifier(message)))
+            session.prediction = result
+            # Части и ссылка для "Поделиться" готовятся один раз и хранятся в сессии рядом с прогнозом
+            session.bundle = render_bundle(result)
+            await sessions.save(session)
 
             # Увеличиваем счётчик сгенерированных прогнозов
             await log_analytics(chat_id, username, forecast_count=1)
             
-            logging.info(f"Прогноз успешно отправлен для chat_id {chat_id}")
+            logging.info("Прогноз успешно отправлен для chat_id %s", chat_id)
 
             # Создаём кнопки
             markup = InlineKeyboardMarkup(inline_keyboard=[
@@ -157,68 +246,78 @@ async def handle_filled_form(message: types.Message):
                 "💡 А что, если ничего не менять? Узнай, какие 3 ключевых события ждут тебя через 5 лет, если ты продолжишь идти тем же путём! Это может быть неожиданно... 😲",
                 reply_markup=markup
             )
+        except Overloaded as e:
+            minutes = max(1, round(e.retry_after / 60))
+            await outbox.send(chat_id, lambda: placeholder.edit_text(
+                "😔 Сейчас слишком много желающих узнать своё будущее, и я не успеваю ответить всем. "
+                f"Пожалуйста, отправь анкету ещё раз примерно через {minutes} мин — я обязательно сделаю прогноз! 🔮"
+            ))
+            logging.warning("Прогноз для chat_id %s отложен из-за перегрузки: %s", chat_id, e)
         except Exception as e:
             await message.answer(
                 "К сожалению, не удалось сгенерировать прогноз. 😔 Возможно, текст слишком длинный. "
                 "Попробуй сократить свои ответы в анкете и отправить её снова. Напиши /start, чтобы начать заново!"
             )
-            logging.error(f"Ошибка при генерации прогноза для chat_id {chat_id}: {e}")
+            logging.error("Ошибка при генерации прогноза для chat_id %s: %s", chat_id, e)
     # Оставляем обработчик секретного текста
     elif message.text == "секретнаяпокупка123":
         chat_id = message.chat.id
-        logging.info(f"Секретная покупка для chat_id {chat_id}")
-        user_input = user_prompts.get(chat_id)
-        previous_result = user_predictions.get(chat_id)
+        logging.info("Секретная покупка для chat_id %s", chat_id)
+        session = await sessions.get(chat_id)
+        user_input = session.prompt if session else None
+        previous_result = session.prediction if session else None
         if not user_input:
             await message.answer(
                 "Сначала заполни анкету! 😊\n"
                 "Отправь /start, чтобы начать заново и заполнить анкету."
             )
-            logging.warning(f"Анкета не найдена для chat_id: {chat_id}")
+            logging.warning("Анкета не найдена для chat_id: %s", chat_id)
             return
         await message.answer("💫 Покупка успешна! Генерирую...")
         try:
-            future = await generate_prediction(user_input, future_mode=True, previous_response=previous_result)
-            message_parts = split_text(future, TELEGRAM_MESSAGE_LIMIT)
-            for part in message_parts:
-                await message.answer(part)
-                await asyncio.sleep(0.5)
+            future = await generate_prediction(
+                user_input, future_mode=True, previous_response=previous_result, priority=PRIORITY_PAID,
+                on_queue=queue_notifier(message)
+            )
+            await send_parts(message, future)
             await message.answer("Если хочешь попробовать другой сценарий, заполни анкету заново с помощью /start! 😊")
             
             # Увеличиваем счётчик оплат и сгенерированных прогнозов
             await log_analytics(chat_id, username, forecast_count=1, payment_count=1)
             
-            logging.info(f"3 события успешно отправлены для chat_id {chat_id}")
+            logging.info("3 события успешно отправлены для chat_id %s", chat_id)
         except Exception as e:
             await message.answer("Произошла ошибка при генерации событий. Пожалуйста, попробуй снова.")
-            logging.error(f"Ошибка при генерации событий для chat_id {chat_id}: {e}")
+            logging.error("Ошибка при генерации событий для chat_id %s: %s", chat_id, e)
     else:
         await message.answer(
             "Кажется, ты отправил что-то не то. 😅 Чтобы я мог сделать прогноз, пожалуйста, заполни анкету. Скопируй её, заполни свои данные и отправь мне обратно. Нажми /start, чтобы получить анкету снова!"
         )
-        logging.warning(f"Сообщение от chat_id {chat_id} не распознано как анкета")
+        logging.warning("Сообщение от chat_id %s не распознано как анкета", chat_id, extra={"category": "unrecognized_form"})
 
 # Обработчик нажатия на кнопку "Раскрыть 3 события"
+# Ответ на повторное нажатие кнопки, пока первое ещё обрабатывается или только что обработано
+async def answer_duplicate_callback(callback_query):
+    await callback_query.answer()
+
+async def answer_duplicate_invoice(callback_query):
+    await callback_query.answer("Счёт уже отправлен, пожалуйста, подожди! 😊")
+
 @dp.callback_query(lambda c: c.data == "learn_scenarios")
+@deduplicate(callback_key, on_duplicate=answer_duplicate_invoice)
 async def process_learn_scenarios(callback_query: types.CallbackQuery):
     callback_id = callback_query.id
     chat_id = callback_query.from_user.id
     username = callback_query.from_user.username or callback_query.from_user.first_name
     message_id = callback_query.message.message_id
 
-    if callback_id in processed_callbacks:
-        logging.info(f"Повторный callback {callback_id} от chat_id {chat_id}, игнорируем")
-        await callback_query.answer("Счёт уже отправлен, пожалуйста, подожди! 😊")
-        return
-
-    processed_callbacks.add(callback_id)
-    logging.info(f"Пользователь {chat_id} нажал на кнопку 'Раскрыть 3 события' (callback_id: {callback_id})")
+    logging.info("Пользователь %s нажал на кнопку 'Раскрыть 3 события' (callback_id: %s)", chat_id, callback_id)
 
     try:
         await bot.delete_message(chat_id=chat_id, message_id=message_id)
-        logging.info(f"Сообщение с кнопками (message_id: {message_id}) удалено для chat_id {chat_id}")
+        logging.info("Сообщение с кнопками (message_id: %s) удалено для chat_id %s", message_id, chat_id)
     except Exception as e:
-        logging.error(f"Ошибка при удалении сообщения для chat_id {chat_id}: {e}")
+        logging.error("Ошибка при удалении сообщения для chat_id %s: %s", chat_id, e)
 
     await callback_query.message.answer(
         "Ты на шаге от того, чтобы узнать 3 ключевых события, которые ждут тебя через 5 лет, если ты не изменишь свой путь! 💡 Это может стать важным открытием для твоего будущего. Всего за 1 звезду ⭐ (валюта Telegram, которую ты можешь купить прямо здесь) я раскрою тебе эти события. Готов?"
@@ -234,9 +333,11 @@ async def process_learn_scenarios(callback_query: types.CallbackQuery):
             currency="XTR",
             prices=[types.LabeledPrice(label="Прогноз", amount=1)],
         )
-        logging.info(f"Счёт на 1 звезду отправлен для chat_id {chat_id}")
+        logging.info("Счёт на 1 звезду отправлен для chat_id %s", chat_id)
+        await start_speculative(chat_id)
+        await log_analytics(chat_id, username, invoice_count=1)
     except Exception as e:
-        logging.error(f"Ошибка при отправке счёта для chat_id {chat_id}: {str(e)} (тип ошибки: {type(e).__name__})")
+        logging.error("Ошибка при отправке счёта для chat_id %s: %s (тип ошибки: %s)", chat_id, e, type(e).__name__)
         await callback_query.message.answer(
             "К сожалению, не удалось создать счёт. 😔 Возможно, Telegram Stars недоступны в твоём регионе. Пожалуйста, свяжись с поддержкой Telegram."
         )
@@ -245,51 +346,56 @@ async def process_learn_scenarios(callback_query: types.CallbackQuery):
 
 # Обработчик нажатия на кнопку "Поделиться прогнозом"
 @dp.callback_query(lambda c: c.data == "share_prediction")
+@deduplicate(callback_key, on_duplicate=answer_duplicate_callback)
 async def share_prediction(callback_query: types.CallbackQuery):
     chat_id = callback_query.from_user.id
     message_id = callback_query.message.message_id
 
     try:
         await bot.delete_message(chat_id=chat_id, message_id=message_id)
-        logging.info(f"Сообщение с кнопками (message_id: {message_id}) удалено для chat_id {chat_id}")
+        logging.info("Сообщение с кнопками (message_id: %s) удалено для chat_id %s", message_id, chat_id)
     except Exception as e:
-        logging.error(f"Ошибка при удалении сообщения для chat_id {chat_id}: {e}")
+        logging.error("Ошибка при удалении сообщения для chat_id %s: %s", chat_id, e)
 
-    prediction = user_predictions.get(chat_id)
+    session = await sessions.get(chat_id)
+    prediction = session.prediction if session else None
     if not prediction:
         await callback_query.message.answer("Прогноз не найден. Попробуй заполнить анкету заново с помощью /start!")
-        logging.warning(f"Прогноз не найден для chat_id {chat_id}")
+        logging.warning("Прогноз не найден для chat_id %s", chat_id)
         return
-    share_text = f"🔮 Мой прогноз на 5 лет вперёд от @LifeIn5Bot:\n\n{prediction}\n\nУзнай, что ждёт тебя: t.me/LifeIn5Bot"
-    message_parts = split_text(share_text, TELEGRAM_MESSAGE_LIMIT)
-    for part in message_parts:
-        await callback_query.message.answer(
-            part,
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="Поделиться", url=f"https://t.me/share/url?url={part}")]
-            ])
-        )
-        await asyncio.sleep(0.5)
+    bundle = session.bundle or render_bundle(prediction)
+    # Кнопка со ссылкой на короткий фрагмент прогноза — под последней частью
+    share_markup = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Поделиться", url=bundle.share_url)]
+    ])
+    for index, part in enumerate(bundle.share_parts):
+        markup = share_markup if index == len(bundle.share_parts) - 1 else None
+        await outbox.send(chat_id, lambda part=part, markup=markup: callback_query.message.answer(part, reply_markup=markup))
     await callback_query.answer()
 
 # Обработчик нажатия на кнопку "Попробовать снова"
 @dp.callback_query(lambda c: c.data == "try_again")
+@deduplicate(callback_key, on_duplicate=answer_duplicate_callback)
 async def try_again(callback_query: types.CallbackQuery):
     chat_id = callback_query.from_user.id
     message_id = callback_query.message.message_id
 
     try:
         await bot.delete_message(chat_id=chat_id, message_id=message_id)
-        logging.info(f"Сообщение с кнопками (message_id: {message_id}) удалено для chat_id {chat_id}")
+        logging.info("Сообщение с кнопками (message_id: %s) удалено для chat_id %s", message_id, chat_id)
     except Exception as e:
-        logging.error(f"Ошибка при удалении сообщения для chat_id {chat_id}: {e}")
-
-    user_prompts.pop(chat_id, None)
-    user_predictions.pop(chat_id, None)
+        logging.error("Ошибка при удалении сообщения для chat_id %s: %s", chat_id, e)
+
+    session = await sessions.get(chat_id)
+    if session:
+        session.prompt = None
+        session.prediction = None
+        session.bundle = None
+        await sessions.save(session)
     await callback_query.message.answer(
         "Давай попробуем снова! Заполни анкету заново, чтобы получить новый прогноз. 😊"
     )
-    await message.answer(
+    await callback_query.message.answer(
         "📝 <b>Давай познакомимся поближе!</b>\n\n"
         "Чтобы я мог сделать точный прогноз твоей жизни через 5 лет, мне нужно узнать о тебе немного больше. Скопируй это сообщение, заполни поля и отправь его мне обратно. Это просто! 😊\n\n"
         "1. Нажми на это сообщение и выбери \"Копировать\".\n"
@@ -311,54 +417,68 @@ async def try_again(callback_query: types.CallbackQuery):
 
 @dp.pre_checkout_query()
 async def process_pre_checkout_query(pre_checkout_query: types.PreCheckoutQuery):
-    logging.info(f"Получен pre_checkout_query: {pre_checkout_query.id}")
+    logging.info("Получен pre_checkout_query: %s", pre_checkout_query.id)
     await bot.answer_pre_checkout_query(pre_checkout_query.id, ok=True)
+    await start_speculative(pre_checkout_query.from_user.id)
 
+# Повторно доставленная оплата с тем же telegram_payment_charge_id не генерирует события заново
 @dp.message(lambda message: message.successful_payment)
+@deduplicate(payment_key, flights=payment_flights)
 async def process_successful_payment(message: types.Message):
     chat_id = message.chat.id
     username = message.from_user.username or message.from_user.first_name
-    logging.info(f"Начало обработки успешной оплаты для chat_id {chat_id}")
-
-    # Логируем полное содержимое message.successful_payment
-    logging.info(f"Полное содержимое successful_payment: {message.successful_payment}")
-
-    payload = message.successful_payment.invoice_payload
-    logging.info(f"Получена успешная оплата с payload: {payload}")
+    payment = message.successful_payment
+    payload = payment.invoice_payload
+    charge_id = payment.telegram_payment_charge_id
+    # Вместо всего объекта оплаты — поля, нужные для сверки с выплатами Telegram
+    logging.info("Успешная оплата для chat_id %s: payload %s, %s %s, charge_id %s",
+                 chat_id, payload, payment.total_amount, payment.currency, charge_id)
 
     if payload == "buy_3_events":
-        logging.info(f"Payload совпадает, начинаем обработку для chat_id {chat_id}")
-        user_input = user_prompts.get(chat_id)
-        previous_result = user_predictions.get(chat_id)
-        logging.info(f"Получены user_input: {user_input is not None}, previous_result: {previous_result is not None}")
+        logging.info("Payload совпадает, начинаем обработку для chat_id %s", chat_id)
+        session = await sessions.get(chat_id)
+        user_input = session.prompt if session else None
+        previous_result = session.prediction if session else None
+        logging.info("Получены user_input: %s, previous_result: %s", user_input is not None, previous_result is not None)
+
+        # Оплата уже обработана раньше (например, до перезапуска бота)
+        if session and session.paid_charge_id == charge_id:
+            logging.info("Оплата %s для chat_id %s уже обработана, игнорируем", charge_id, chat_id)
+            return
 
         if not user_input:
-            logging.warning(f"Анкета не найдена для chat_id: {chat_id}")
+            logging.warning("Анкета не найдена для chat_id: %s", chat_id)
             await message.answer("Сначала заполни анкету! Нажми /start, чтобы начать заново.")
             return
 
         await message.answer("💫 Покупка успешна! Генерирую твои 3 ключевых события... ⏳")
-        logging.info(f"Сообщение о начале генерации отправлено для chat_id {chat_id}")
+        logging.info("Сообщение о начале генерации отправлено для chat_id %s", chat_id)
 
         try:
-            future = await generate_prediction(user_input, future_mode=True, previous_response=previous_result)
-            logging.info(f"Прогноз успешно сгенерирован для chat_id {chat_id}")
-
-            message_parts = split_text(future, TELEGRAM_MESSAGE_LIMIT)
-            for part in message_parts:
-                await message.answer(part)
-                await asyncio.sleep(0.5)
+            # Если генерация началась заранее, результат уже готов или скоро будет
+            future = await speculative.take(chat_id, user_input, previous_result)
+            if future is None:
+                future = await generate_prediction(
+                    user_input, future_mode=True, previous_response=previous_result, priority=PRIORITY_PAID,
+                    on_queue=queue_notifier(message)
+                )
+            logging.info("Прогноз успешно сгенерирован для chat_id %s", chat_id)
+
+            await send_parts(message, future)
             await message.answer("Если хочешь попробовать другой сценарий, заполни анкету заново с помощью /start! 😊")
+
+            session.paid_charge_id = charge_id
+            await sessions.save(session)
             
             # Увеличиваем счётчик оплат и сгенерированных прогнозов
             await log_analytics(chat_id, username, forecast_count=1, payment_count=1)
             
-            logging.info(f"3 события успешно отправлены для chat_id {chat_id}")
+            logging.info("3 события успешно отправлены для chat_id %s", chat_id)
         except Exception as e:
-            logging.error(f"Ошибка при генерации событий для chat_id {chat_id}: {e}")
+            logging.error("Ошибка при генерации событий для chat_id %s: %s", chat_id, e)
             await message.answer("Произошла ошибка при генерации событий. Пожалуйста, попробуй снова.")
     else:
-        logging.warning(f"Неизвестный payload: {payload} для chat_id {chat_id}")
+        logging.warning("Неизвестный payload: %s для chat_id %s", payload, chat_id)
         await message.answer("Произошла ошибка: неизвестный тип оплаты. Пожалуйста, свяжись с поддержкой.")
 
 # Обработчик для отладки необработанных сообщений
@@ -366,10 +486,60 @@ async def process_successful_payment(message: types.Message):
 async def debug_unhandled(message: types.Message):
     # Проверяем, есть ли атрибут text, чтобы избежать ошибок в логах
     text = getattr(message, 'text', 'Нет текста')
-    logging.info(f"Необработанное сообщение: {text} от chat_id {message.chat.id}")
+    # Таких сообщений много (стикеры, фото, голосовые), в лог попадает выборка
+    logging.info("Необработанное сообщение: %s от chat_id %s", text, message.chat.id, extra={"category": "unhandled"})
+
+# Метрики состояния: вычисляются при каждом запросе /metrics
+Gauge("bot_llm_in_flight", "Запросы к OpenAI в работе", lambda: llm_scheduler.in_flight)
+Gauge("bot_llm_queue_depth", "Запросы к OpenAI в очереди", llm_scheduler.queue_depth)
+Gauge("bot_sessions", "Сессии чатов в хранилище", lambda: len(sessions))
+Gauge("bot_session_evictions", "Вытесненные по лимиту памяти сессии", lambda: sessions.stats().get("evictions", 0))
+Gauge("bot_speculative_hit_rate", "Доля оплат, обслуженных заготовкой", lambda: speculative.stats()["hit_rate"])
+Gauge("bot_speculative_cancelled", "Заготовки продолжений, отменённые без использования", lambda: speculative.cancelled)
+Gauge("bot_speculative_wasted_tokens", "Токены, потраченные на неиспользованные заготовки", lambda: speculative.wasted_tokens)
+Gauge("bot_llm_degradation_level", "Уровень деградации бесплатных прогнозов (0 — полное качество)", lambda: load_shedder.level)
+Gauge("bot_duplicate_updates", "Повторные формы, нажатия и оплаты, не выполненные заново", lambda: single_flight.duplicates + payment_flights.duplicates)
+Gauge("bot_prediction_cache_hits", "Прогнозы, выданные из кэша (память и диск)", lambda: prediction_cache.hits)
+Gauge("bot_prediction_cache_disk_hits", "Прогнозы, поднятые из дискового уровня кэша", lambda: prediction_cache.disk_hits)
+Gauge("bot_prediction_cache_misses", "Промахи кэша прогнозов", lambda: prediction_cache.misses)
+Gauge("bot_prediction_cache_evictions", "Записи кэша прогнозов, вытесненные из памяти", lambda: prediction_cache.evictions)
+Gauge("bot_prediction_cache_bytes", "Память под записи кэша прогнозов", lambda: prediction_cache.size_bytes)
+Gauge("bot_prediction_cache_disk_bytes", "Размер дискового уровня кэша на момент последней очистки", lambda: prediction_cache.disk_bytes)
+Gauge("bot_log_records_dropped", "Записи лога, отброшенные при переполнении очереди записи", lambda: logging_stats()["queue_full"])
+
+_warm_up_task = None
+
+# Клиенты OpenAI и Bot API создаются и открывают соединения в фоне: приём обновлений их не ждёт
+async def warm_up_clients():
+    results = await asyncio.gather(warm_up(), bot.me(), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logging.warning("Прогрев клиента не удался: %s: %s", type(result).__name__, result)
+
+async def on_startup():
+    global _warm_up_task
+    logging.info("Модули загружены за %.2f с после запуска", time.monotonic() - LAUNCHED_AT)
+    _warm_up_task = asyncio.create_task(warm_up_clients())
+    await start_analytics()
+    await start_metrics()
+
+async def on_shutdown():
+    if _warm_up_task is not None:
+        _warm_up_task.cancel()
+    await stop_metrics()
+    await stop_analytics()
+    logging.info("Расход токенов OpenAI по режимам: %s", usage_report())
 
 async def main():
     print("🚀 Бот запущен...")
+    if BOT_MODE == "webhook":
+        # Обновления принимает вебхук, обработкой занимаются отдельные процессы
+        from webhook import serve
+        await serve(bot)
+        await bot.session.close()
+        return
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
     await dp.start_polling(bot)
 
 if __name__ == '__main__':
@@ -0,0 +1,215 @@
+import asyncio
+import bisect
+import logging
+import os
+import threading
+import time
+
+from aiohttp import web
+
+# Порт HTTP-эндпоинта /metrics в формате Prometheus; 0 (по умолчанию) — не запускать
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Как часто измерять задержку цикла событий (сек)
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+
+# Границы корзин гистограмм по умолчанию (сек)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_metrics = []
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for label_values, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+# Значение вычисляется при каждом запросе /metrics
+class Gauge:
+    def __init__(self, name, documentation, read):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+        _metrics.append(self)
+
+    def render(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge", f"{self.name} {self.read()}"]
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}  # {label_values: [counts по корзинам..., count, sum]}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    # Замер длительности блока: with histogram.time("label"): ...
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_values, series in self._series.items():
+            names = self.labels + ("le",)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, label_values + (bound,))} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+        return lines
+
+class _Timer:
+    __slots__ = ("histogram", "label_values", "started")
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
+
+def render_metrics():
+    lines = []
+    for metric in _metrics:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            logging.error("Не удалось вычислить метрику %s: %s", metric.name, e)
+    return "\n".join(lines) + "\n"
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Время работы хендлера", ("handler",))
+UPDATE_SECONDS = Histogram("bot_update_seconds", "Полное время обработки обновления", ("type",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в хендлерах", ("handler",))
+LLM_SECONDS = Histogram("bot_llm_request_seconds", "Время запроса к OpenAI", ("mode",))
+LLM_ATTEMPT_SECONDS = Histogram(
+    "bot_llm_attempt_seconds", "Время одной попытки запроса к OpenAI (основной, повтор, дубль, запасная модель)",
+    ("model", "kind", "outcome")
+)
+LLM_QUEUE_WAIT_SECONDS = Histogram("bot_llm_queue_wait_seconds", "Ожидание слота на запрос к OpenAI", ("priority",))
+LLM_DEGRADED = Counter("bot_llm_degraded_total", "Бесплатные прогнозы с сокращённым ответом", ("level",))
+LLM_DEFERRED = Counter("bot_llm_deferred_total", "Бесплатные прогнозы, отложенные из-за перегрузки")
+ANALYTICS_ROLLUP_DROPPED = Counter(
+    "bot_analytics_rollup_dropped_total", "События, отброшенные из очереди записи в дневные сводки при их недоступности"
+)
+ANALYTICS_WRITE_SECONDS = Histogram("bot_analytics_write_seconds", "Время записи пачки событий аналитики", ("backend",))
+TELEGRAM_SEND_SECONDS = Histogram("bot_telegram_send_seconds", "Время запроса к Bot API при отправке", ())
+TELEGRAM_WAIT_SECONDS = Histogram("bot_telegram_wait_seconds", "Ожидание в очереди отправки", ())
+LOOP_LAG_SECONDS = Histogram(
+    "bot_event_loop_lag_seconds", "Задержка цикла событий", (), (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+)
+
+# Мидлварь замера времени. Как внешняя на dp.update меряет всё обновление целиком,
+# как внутренняя на dp.message / dp.callback_query / ... — конкретный хендлер.
+# launched_at — time.monotonic() запуска процесса: от него отсчитывается первое обработанное обновление.
+class TimingMiddleware:
+    def __init__(self, launched_at=None):
+        self.launched_at = launched_at
+        self.first_update_seconds = None
+
+    def _first_update(self):
+        self.first_update_seconds = time.monotonic() - self.launched_at
+        logging.info("Первое обновление обработано через %.2f с после запуска", self.first_update_seconds)
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            if handler_object is not None:
+                HANDLER_ERRORS.inc(handler_object.callback.__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            if handler_object is not None:
+                HANDLER_SECONDS.observe(elapsed, handler_object.callback.__name__)
+            else:
+                UPDATE_SECONDS.observe(elapsed, event.event_type)
+                if self.first_update_seconds is None and self.launched_at is not None:
+                    self._first_update()
+
+def install_middleware(dp, launched_at=None):
+    middleware = TimingMiddleware(launched_at)
+    dp.update.outer_middleware(middleware)
+    for observer in (dp.message, dp.callback_query, dp.pre_checkout_query):
+        observer.middleware(middleware)
+    Gauge(
+        "bot_first_update_seconds", "Время от запуска процесса до первого обработанного обновления",
+        lambda: float("nan") if middleware.first_update_seconds is None else middleware.first_update_seconds
+    )
+
+async def _monitor_loop_lag():
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        LOOP_LAG_SECONDS.observe(max(0.0, time.perf_counter() - started - LOOP_LAG_INTERVAL))
+
+async def _handle_metrics(request):
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+_runner = None
+_lag_task = None
+
+async def start_metrics():
+    global _runner, _lag_task
+    _lag_task = asyncio.create_task(_monitor_loop_lag())
+    if not METRICS_PORT:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    try:
+        await web.TCPSite(_runner, METRICS_HOST, METRICS_PORT).start()
+    except OSError as e:
+        # Занятый порт не должен мешать боту принимать обновления: работаем без /metrics
+        logging.error("Не удалось открыть порт метрик %s:%d: %s", METRICS_HOST, METRICS_PORT, e)
+        await _runner.cleanup()
+        _runner = None
+        return
+    logging.info("Метрики доступны на http://%s:%d/metrics", METRICS_HOST, METRICS_PORT)
+
+async def stop_metrics():
+    global _runner, _lag_task
+    if _lag_task is not None:
+        _lag_task.cancel()
+        _lag_task = None
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,82 @@
+from questionnaire import Questionnaire, format_questionnaire
+
+# Шаблоны промптов. Вся статичная часть (роль, инструкции, список разделов) идёт в начале
+# и одинакова побайтно во всех запросах одного режима, данные пользователя — в самом конце.
+# Так OpenAI может переиспользовать закэшированный префикс (prompt caching).
+
+SYSTEM_ROLE = (
+    "Представь, что ты опытный психолог с 30-летним стажем, который умеет прогнозировать будущее человека. "
+    "Учитывай жизненный сценарий человека, условия экономики и политики государства, в котором он живет, его возраст "
+    "и общий контекст его жизни. Проанализируй данные обо мне из моего сообщения и создай реалистичное, детализированное описание моей жизни."
+)
+
+BASE_INSTRUCTIONS = (
+    "На основе этих данных создай детальное описание моей жизни через 5 лет. "
+    "Учти следующие аспекты: карьера, здоровье, семейная жизнь, хобби, финансы, социальные связи. "
+    "Опиши, как экономика и политика моей страны повлияют на мою жизнь. "
+    "Структурируй ответ в виде нумерованного списка с 3-5 пунктами, используя формат '1.', '2.', '3.' и т.д. "
+    "(например: '1. Текст', '2. Текст', '3. Текст'). Не используй звёздочки (*). "
+    "Каждый пункт должен быть детализированным, содержать не менее 4-5 предложений и описывать конкретные изменения в моей жизни. "
+    "Сделай описание живым, с примерами и деталями, чтобы оно выглядело как реальная картина моей будущей жизни."
+    "🕰 Твоя жизнь через 5 лет (тебе [возраст] лет):, 📍 Общий фон, 👔 Работа, 🧠 Психологическое состояние, "
+    "🏡 Личная жизнь, 🩺 Здоровье, 🎣 Интересы, 📌 Заключение:, 💡 Возможные векторы поворота:. "
+    "Каждый раздел должен быть детализированным и содержать не менее 3-4 предложений."
+)
+
+# Сокращённые шаблоны бесплатного прогноза для работы под нагрузкой: меньше разделов и предложений
+BASE_INSTRUCTIONS_SHORT = (
+    "На основе этих данных создай описание моей жизни через 5 лет. "
+    "Учти карьеру, здоровье, семейную жизнь, финансы и то, как экономика моей страны повлияет на мою жизнь. "
+    "Не используй звёздочки (*). Разделы: "
+    "🕰 Твоя жизнь через 5 лет (тебе [возраст] лет):, 👔 Работа, 🏡 Личная жизнь, 🩺 Здоровье, 💡 Возможные векторы поворота:. "
+    "Каждый раздел — 2-3 предложения с конкретными деталями."
+)
+
+BASE_INSTRUCTIONS_BRIEF = (
+    "На основе этих данных кратко опиши мою жизнь через 5 лет. Не используй звёздочки (*). Разделы: "
+    "🕰 Твоя жизнь через 5 лет (тебе [возраст] лет):, 👔 Работа и деньги, 🏡 Личная жизнь и здоровье. "
+    "Каждый раздел — 1-2 предложения."
+)
+
+FUTURE_INSTRUCTIONS = (
+    "В моём сообщении — данные обо мне и предыдущий прогноз моей жизни через 5 лет. "
+    "На основе предыдущего прогноза покажи три события, которые меня ждут, если я не выйду из жизненного сценария, "
+    "согласно транзактного анализа, какие у них будут последствия, и как они отразятся на мне и моем здоровье? "
+    "Каждый пункт должен быть детализированным, содержать не менее 4-5 предложений и описывать конкретные изменения в моей жизни."
+)
+
+SYSTEM_PROMPTS = {
+    "base": f"{SYSTEM_ROLE}\n\n{BASE_INSTRUCTIONS}",
+    "future": f"{SYSTEM_ROLE}\n\n{FUTURE_INSTRUCTIONS}",
+}
+# Шаблоны бесплатного прогноза по уровню сокращения: 0 — полный
+BASE_PROMPTS_BY_LEVEL = (
+    SYSTEM_PROMPTS["base"],
+    f"{SYSTEM_ROLE}\n\n{BASE_INSTRUCTIONS_SHORT}",
+    f"{SYSTEM_ROLE}\n\n{BASE_INSTRUCTIONS_BRIEF}",
+)
+
+# Режим запроса: продолжение возможно только при наличии предыдущего прогноза
+def prompt_mode(future_mode=False, previous_response=None):
+    return "future" if future_mode and previous_response else "base"
+
+# Анкета передаётся модели в компактном виде: разобранная запись или уже собранный из неё текст
+def compact_input(user_input):
+    if isinstance(user_input, Questionnaire):
+        return format_questionnaire(user_input)
+    return user_input
+
+# Сообщения для модели: статичный системный промпт режима, затем данные пользователя.
+# level > 0 — сокращённый шаблон базового прогноза; на продолжение (future) не влияет.
+def build_messages(user_input, future_mode=False, previous_response=None, level=0):
+    mode = prompt_mode(future_mode, previous_response)
+    user_content = compact_input(user_input)
+    if mode == "future":
+        user_content += f"\n\nПредыдущий прогноз:\n{previous_response}"
+        system_prompt = SYSTEM_PROMPTS[mode]
+    else:
+        system_prompt = BASE_PROMPTS_BY_LEVEL[min(level, len(BASE_PROMPTS_BY_LEVEL) - 1)]
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_content}
+    ]
@@ -0,0 +1,102 @@
+import html
+import re
+from typing import NamedTuple, Union
+
+# Анкета из восьми полей в том виде, в каком её заполняет пользователь
+class Questionnaire(NamedTuple):
+    # Число, если в ответе есть цифры, иначе текст ответа (например, "двадцать пять")
+    age: Union[int, str]
+    country: str
+    family: str
+    interests: str
+    work: str
+    health: str
+    routine: str
+    dream: str
+
+# Подписи полей в анкете, которую отправляет бот
+FIELD_LABELS = {
+    "age": r"мой\s+возраст",
+    "country": r"страна,?\s+где\s+я\s+живу",
+    "family": r"семейное\s+положение",
+    "interests": r"мои\s+3\s*[-–—]\s*5\s+главных\s+интересов",
+    "work": r"как\s+я\s+зарабатываю\s+на\s+жизнь",
+    "health": r"как\s+я\s+забочусь\s+о\s+сво[её]м\s+здоровье",
+    "routine": r"моя\s+рутина\s+в\s+жизни",
+    "dream": r"моя\s+самая\s+большая\s+мечта",
+}
+# Названия полей в промпте для модели
+FIELD_TITLES = {
+    "age": "Возраст",
+    "country": "Страна",
+    "family": "Семейное положение",
+    "interests": "Интересы",
+    "work": "Работа",
+    "health": "Забота о здоровье",
+    "routine": "Распорядок дня",
+    "dream": "Мечта",
+}
+# Максимальная длина ответа в каждом поле (символов)
+FIELD_LIMITS = {
+    "age": 20,
+    "country": 60,
+    "family": 80,
+    "interests": 200,
+    "work": 200,
+    "health": 200,
+    "routine": 300,
+    "dream": 200,
+}
+
+# Подпись поля считается подписью, только если стоит в начале строки (можно после тегов) или за ней идёт двоеточие:
+# те же слова внутри ответа ("мечта: чтобы моя рутина в жизни была спокойной") не начинают новое поле
+_LABEL_RE = re.compile(
+    r"(?P<line_start>^[ \t]*(?:<[^>]*>[ \t]*)*)?(?:"
+    + "|".join(f"(?P<{field}>{pattern})" for field, pattern in FIELD_LABELS.items())
+    + r")(?P<colon>[ \t]*:)?",
+    re.IGNORECASE | re.MULTILINE
+)
+_TAG_RE = re.compile(r"<[^>]*>")
+# Подсказка из шаблона "(например, …)" сразу после подписи; такие же скобки дальше в ответе — слова пользователя
+_HINT_RE = re.compile(r"^\s*\(\s*например\b[^)]*\)?", re.IGNORECASE)
+_SPACE_RE = re.compile(r"\s+")
+_AGE_RE = re.compile(r"\d{1,3}")
+
+def _clean(value, limit):
+    value = html.unescape(_TAG_RE.sub(" ", value))
+    value = _HINT_RE.sub(" ", value, count=1)
+    value = _SPACE_RE.sub(" ", value).strip(" .,;:-–—")
+    return value[:limit].rstrip()
+
+# Разбор сообщения с анкетой. None — если обязательные поля (возраст и страна) отсутствуют или не заполнены,
+# например, когда шаблон отправлен обратно с одними подсказками.
+def parse_questionnaire(text):
+    if not text:
+        return None
+    matches = [
+        match for match in _LABEL_RE.finditer(text)
+        if match.group("line_start") is not None or match.group("colon")
+    ]
+    values = {}
+    for index, match in enumerate(matches):
+        end = matches[index + 1].start() if index + 1 < len(matches) else len(text)
+        field = next(name for name in FIELD_LABELS if match.group(name))
+        # Если поле встречается дважды, берём первое непустое значение
+        if not values.get(field):
+            values[field] = _clean(text[match.end():end], FIELD_LIMITS[field])
+    if not values.get("age") or not values.get("country"):
+        return None
+
+    age = _AGE_RE.search(values["age"])
+    return Questionnaire(
+        age=int(age.group()) if age else values["age"],
+        **{field: values.get(field, "") for field in FIELD_LABELS if field != "age"}
+    )
+
+# Компактное представление анкеты для промпта: только заполненные поля
+def format_questionnaire(record):
+    lines = []
+    for field, value in record._asdict().items():
+        if value not in (None, ""):
+            lines.append(f"{FIELD_TITLES[field]}: {value}")
+    return "\n".join(lines)
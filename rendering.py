@@ -0,0 +1,113 @@
+import html
+import os
+import re
+from typing import NamedTuple, Tuple
+from urllib.parse import quote
+
+# Максимальная длина сообщения в Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Длина фрагмента прогноза в ссылке "Поделиться" (символов)
+SHARE_SNIPPET_LIMIT = int(os.getenv("SHARE_SNIPPET_LIMIT", "120"))
+
+BOT_LINK = "t.me/LifeIn5Bot"
+SHARE_HEADER = "🔮 Мой прогноз на 5 лет вперёд от @LifeIn5Bot:\n\n"
+SHARE_FOOTER = f"\n\nУзнай, что ждёт тебя: {BOT_LINK}"
+
+# Открывающий или закрывающий тег
+_MARKUP_RE = re.compile(r"<(/?)([a-zA-Z][\w-]*)[^>]*>")
+# Незавершённый тег или HTML-сущность в конце фрагмента
+_OPEN_TAIL_RE = re.compile(r"<[^>]*$|&#?\w*$")
+_TAG_RE = re.compile(r"<[^>]+>")
+_SPACE_RE = re.compile(r"\s+")
+
+class MessageBundle(NamedTuple):
+    parts: Tuple[str, ...]  # прогноз, разбитый на сообщения
+    share_parts: Tuple[str, ...]  # текст для пересылки друзьям
+    share_url: str  # короткая ссылка t.me/share с началом прогноза
+
+# Теги, открытые после text[start:end], с учётом уже открытых stack: [(имя, открывающий тег)]
+def _open_tags(text, start, end, stack):
+    stack = list(stack)
+    for match in _MARKUP_RE.finditer(text, start, end):
+        name = match[2].lower()
+        if not match[1]:
+            stack.append((name, match[0]))
+        elif stack and stack[-1][0] == name:
+            stack.pop()
+    return stack
+
+def _closing_tags(stack):
+    return "".join(f"</{name}>" for name, _ in reversed(stack))
+
+# Разбиение HTML за один проход без срезов остатка строки: разрез по переносу строки или пробелу,
+# никогда внутри тега или сущности. Открытые на месте разреза теги закрываются в конце части
+# и открываются заново в следующей. Выдаёт (часть, индекс продолжения в text, открытые теги).
+def _iter_html_parts(text, limit):
+    stack = []
+    prefix = ""
+    start = 0
+    while start < len(text):
+        if len(prefix) + len(text) - start <= limit:
+            yield prefix + text[start:], len(text), _open_tags(text, start, len(text), stack)
+            return
+        budget = limit - len(prefix) - len(_closing_tags(stack))
+        while True:
+            end = start + max(budget, 1)
+            # Перенос строки предпочтительнее, если он не слишком далеко от конца части
+            cut = text.rfind("\n", start + budget // 2, end)
+            if cut == -1:
+                cut = text.rfind(" ", start, end)
+            if cut == -1:
+                cut = text.rfind("\n", start, end)
+            if cut <= start:
+                cut = end
+            tail = _OPEN_TAIL_RE.search(text, start, cut)
+            if tail and tail.start() > start:
+                cut = tail.start()
+            cut_stack = _open_tags(text, start, cut, stack)
+            excess = len(prefix) + cut - start + len(_closing_tags(cut_stack)) - limit
+            if excess <= 0 or budget <= 1:
+                break
+            # Внутри части открылись новые теги: их закрытие тоже должно уместиться
+            budget -= excess
+        body = text[start:cut]
+        if body.strip():
+            yield prefix + body + _closing_tags(cut_stack), cut, cut_stack
+        start = _SPACE_RE.match(text, cut).end() if text[cut:cut + 1].isspace() else cut
+        stack = cut_stack
+        prefix = "".join(tag for _, tag in stack)
+
+# Функция для разбиения текста на части
+def split_text(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    return [part for part, _, _ in _iter_html_parts(text, limit)]
+
+# Первая часть текста и остаток с заново открытыми тегами — для потокового вывода
+def cut_text(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    for head, split_at, stack in _iter_html_parts(text, limit):
+        rest = text[split_at:].lstrip()
+        return head, "".join(tag for _, tag in stack) + rest if rest else ""
+    return "", ""
+
+# Текст без видимых символов: только пробелы и теги. Telegram не отправляет такое сообщение.
+def is_blank(text):
+    return not _TAG_RE.sub("", text).strip()
+
+# Короткий фрагмент прогноза без разметки для ссылки t.me/share
+def share_snippet(text, limit=SHARE_SNIPPET_LIMIT):
+    plain = _SPACE_RE.sub(" ", html.unescape(_TAG_RE.sub(" ", text))).strip()
+    if len(plain) <= limit:
+        return plain
+    cut = plain.rfind(" ", 0, limit)
+    return plain[:cut if cut > 0 else limit].rstrip(" ,.;:-") + "…"
+
+def share_url(text):
+    snippet = f"🔮 Мой прогноз на 5 лет вперёд: {share_snippet(text)}"
+    return f"https://t.me/share/url?url={quote(BOT_LINK)}&text={quote(snippet)}"
+
+# Всё, что отправляется для прогноза. Бот рендерит прогноз один раз и хранит результат в сессии рядом с ним.
+def render_bundle(text):
+    return MessageBundle(
+        parts=tuple(split_text(text)),
+        share_parts=tuple(split_text(SHARE_HEADER + text + SHARE_FOOTER)),
+        share_url=share_url(text),
+    )
@@ -0,0 +1,98 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+
+from metrics import LLM_QUEUE_WAIT_SECONDS
+
+# Сколько запросов к OpenAI может выполняться одновременно
+MAX_CONCURRENT_LLM = int(os.getenv("MAX_CONCURRENT_LLM", "20"))
+# Через сколько секунд ожидания сообщать пользователю его место в очереди
+QUEUE_NOTIFY_AFTER = float(os.getenv("LLM_QUEUE_NOTIFY_AFTER", "3"))
+
+# Чем меньше число, тем раньше запрос покинет очередь
+PRIORITY_PAID = 0
+PRIORITY_FREE = 1
+_PRIORITY_LABELS = {PRIORITY_PAID: "paid", PRIORITY_FREE: "free"}
+
+class LLMScheduler:
+    def __init__(self, limit=MAX_CONCURRENT_LLM, notify_after=QUEUE_NOTIFY_AFTER):
+        self.limit = limit
+        self.notify_after = notify_after
+        self.in_flight = 0
+        self._waiters = []  # куча (priority, seq, future)
+        self._seq = itertools.count()
+        self.completed_waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def queue_depth(self):
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    # Место в очереди (1 — следующий на выполнение)
+    def position(self, entry):
+        return 1 + sum(1 for waiter in self._waiters if waiter < entry and not waiter[2].done())
+
+    async def acquire(self, priority=PRIORITY_FREE, on_wait=None):
+        if self.in_flight < self.limit and not self.queue_depth():
+            self.in_flight += 1
+            LLM_QUEUE_WAIT_SECONDS.observe(0.0, _PRIORITY_LABELS.get(priority, str(priority)))
+            return 0.0
+
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), future)
+        heapq.heappush(self._waiters, entry)
+        try:
+            if on_wait is None:
+                await future
+            else:
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), self.notify_after)
+                except asyncio.TimeoutError:
+                    await on_wait(self.position(entry))
+                    await future
+        except BaseException:
+            # Отмена или ошибка в on_wait: слот мог быть уже передан этому запросу — возвращаем его следующему,
+            # иначе убираем ожидание, чтобы release() не отдал слот тому, кто его уже не ждёт
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                future.cancel()
+            raise
+
+        waited = time.monotonic() - started
+        self.completed_waits += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        LLM_QUEUE_WAIT_SECONDS.observe(waited, _PRIORITY_LABELS.get(priority, str(priority)))
+        return waited
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # Слот переходит ожидающему запросу, in_flight не меняется
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority=PRIORITY_FREE, on_wait=None):
+        await self.acquire(priority, on_wait)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth(),
+            "avg_wait": self.total_wait / self.completed_waits if self.completed_waits else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+llm_scheduler = LLMScheduler()
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import os
+import time
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from metrics import TELEGRAM_SEND_SECONDS, TELEGRAM_WAIT_SECONDS
+
+# Общий лимит бота на отправку сообщений (сообщений в секунду)
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+# Лимит на один чат и сколько сообщений можно отправить в него подряд без ожидания
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", "5"))
+# Сколько раз повторять отправку после ответа 429
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+# При скольких корзинах чатов начинать удалять простаивающие
+CHAT_BUCKETS_PRUNE_AT = 10000
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    # Резервирует один токен и возвращает, сколько секунд ждать до его появления.
+    # Баланс может уйти в минус: так очередь ожидающих выстраивается без отдельной структуры.
+    def reserve(self):
+        self._refill()
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    # Пауза после 429: следующий токен появится не раньше чем через delay секунд
+    def pause(self, delay):
+        self._refill()
+        self.tokens = min(self.tokens, 1 - delay * self.rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def idle(self):
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+# Единая точка отправки в Telegram: общий лимит бота и лимит на каждый чат
+class Outbox:
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE, chat_burst=TELEGRAM_CHAT_BURST):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = {}
+        self.sent = 0
+        self.retries = 0
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= CHAT_BUCKETS_PRUNE_AT:
+                self.chat_buckets = {key: value for key, value in self.chat_buckets.items() if not value.idle()}
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    # make_request — функция без аргументов, создающая запрос заново (он может повторяться)
+    async def send(self, chat_id, make_request):
+        for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+            chat_delay = self._chat_bucket(chat_id).reserve()
+            if chat_delay:
+                await asyncio.sleep(chat_delay)
+            global_delay = self.global_bucket.reserve()
+            if global_delay:
+                await asyncio.sleep(global_delay)
+            TELEGRAM_WAIT_SECONDS.observe(chat_delay + global_delay)
+            try:
+                with TELEGRAM_SEND_SECONDS.time():
+                    result = await make_request()
+                self.sent += 1
+                return result
+            except TelegramRetryAfter as e:
+                if attempt == TELEGRAM_MAX_RETRIES:
+                    raise
+                self.retries += 1
+                logging.warning("Telegram просит подождать %s с перед отправкой в chat_id %s", e.retry_after, chat_id)
+                self._chat_bucket(chat_id).pause(e.retry_after)
+
+    def stats(self):
+        return {"sent": self.sent, "retries": self.retries, "chat_buckets": len(self.chat_buckets)}
+
+outbox = Outbox()
@@ -0,0 +1,245 @@
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from rendering import MessageBundle
+
+# Сколько хранить состояние чата после последнего обращения (сек)
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+# Сколько памяти могут занимать все сессии (байт)
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+# Где хранить сессии: "memory" — в процессе, "sqlite" — общая база для нескольких процессов
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_DB = os.getenv("SESSION_DB", "sessions.db")
+# Как часто (в сохранениях) удалять просроченные сессии из базы
+SESSION_SWEEP_EVERY = 1000
+# Как часто пересчитывать число сессий в базе для метрик (сек)
+SESSION_COUNT_INTERVAL = 60
+
+# Состояние одного чата: анкета, прогноз, время сессии и счётчики аналитики
+class Session:
+    __slots__ = (
+        "chat_id", "prompt", "prediction", "start_time", "last_time",
+        "start_count", "forecast_count", "payment_count", "paid_charge_id", "bundle", "size",
+    )
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.prompt = None
+        self.prediction = None
+        self.start_time = None
+        self.last_time = None
+        self.start_count = 0
+        self.forecast_count = 0
+        self.payment_count = 0
+        self.paid_charge_id = None  # telegram_payment_charge_id последней обработанной оплаты
+        self.bundle = None  # rendering.MessageBundle для prediction: части и ссылка "Поделиться"
+        self.size = 0
+
+# Оценка накладных расходов на сессию сверх строк: сам объект, числа, кортеж и запись в OrderedDict
+SESSION_OVERHEAD = (
+    sys.getsizeof(Session(0)) + 3 * sys.getsizeof(0.0) + sys.getsizeof(2 ** 40) + sys.getsizeof((0.0, None)) + 112
+)
+
+def _bundle_size(bundle):
+    size = sys.getsizeof(bundle) + sys.getsizeof(bundle.parts) + sys.getsizeof(bundle.share_parts)
+    return size + sum(map(sys.getsizeof, bundle.parts + bundle.share_parts)) + sys.getsizeof(bundle.share_url)
+
+def _session_size(session):
+    size = SESSION_OVERHEAD
+    for value in (session.prompt, session.prediction, session.paid_charge_id):
+        if value is not None:
+            size += sys.getsizeof(value)
+    if session.bundle is not None:
+        size += _bundle_size(session.bundle)
+    return size
+
+# Хранилище сессий с TTL и общим лимитом памяти: при превышении вытесняются давно не активные чаты
+class SessionStore:
+    def __init__(self, ttl=SESSION_TTL, max_bytes=SESSION_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()  # {chat_id: (touched, session)}, от давних к свежим
+        self.size_bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, chat_id):
+        entry = self._sessions.get(chat_id)
+        if entry is None:
+            return None
+        touched, session = entry
+        now = time.monotonic()
+        if now - touched > self.ttl:
+            self._drop(chat_id)
+            self.expirations += 1
+            return None
+        self._sessions[chat_id] = (now, session)
+        self._sessions.move_to_end(chat_id)
+        return session
+
+    def get_or_create(self, chat_id):
+        session = self.get(chat_id)
+        if session is None:
+            session = Session(chat_id)
+            self.save(session)
+        return session
+
+    # Вызывается после изменения сессии: обновляет время обращения и учёт памяти
+    def save(self, session):
+        now = time.monotonic()
+        self._drop(session.chat_id)
+        session.size = _session_size(session)
+        self._sessions[session.chat_id] = (now, session)
+        self.size_bytes += session.size
+        self._evict(now)
+
+    def delete(self, chat_id):
+        self._drop(chat_id)
+
+    def _drop(self, chat_id):
+        entry = self._sessions.pop(chat_id, None)
+        if entry is not None:
+            self.size_bytes -= entry[1].size
+
+    def _evict(self, now):
+        # Просроченные сессии всегда в начале: порядок совпадает с порядком обращений
+        while self._sessions:
+            chat_id, (touched, session) = next(iter(self._sessions.items()))
+            if now - touched > self.ttl:
+                self.expirations += 1
+            elif self.size_bytes > self.max_bytes and len(self._sessions) > 1:
+                self.evictions += 1
+            else:
+                break
+            self._drop(chat_id)
+
+    def stats(self):
+        return {
+            "sessions": len(self._sessions),
+            "size_bytes": self.size_bytes,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+# Поля сессии, которые сохраняются в базе
+SESSION_FIELDS = tuple(field for field in Session.__slots__ if field != "size")
+
+# Хранилище сессий в SQLite: его видят все процессы-обработчики вебхука.
+# Методы блокируют поток до 30 с при занятой базе, поэтому вызываются через AsyncSessions из отдельного потока.
+class SqliteSessionStore:
+    def __init__(self, path=SESSION_DB, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self.saves = 0
+        self.expirations = 0
+        # Соединение создаётся здесь, а используется только потоком AsyncSessions
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sessions (chat_id INTEGER PRIMARY KEY, touched REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS sessions_touched ON sessions (touched)")
+        # Новые поля Session добавляются в таблицу без отдельной миграции
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(sessions)")}
+        for field in SESSION_FIELDS:
+            if field not in columns:
+                self.conn.execute(f"ALTER TABLE sessions ADD COLUMN {field}")
+        self._select = f"SELECT touched, {', '.join(SESSION_FIELDS)} FROM sessions WHERE chat_id = ?"
+        self._upsert = (
+            f"INSERT OR REPLACE INTO sessions (touched, {', '.join(SESSION_FIELDS)}) "
+            f"VALUES (?, {', '.join('?' for _ in SESSION_FIELDS)})"
+        )
+        self._count()
+
+    def _count(self):
+        self.count = self.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        self._counted_at = time.monotonic()
+
+    # Число сессий на момент последнего пересчёта: метрики не запускают COUNT(*) при каждом опросе
+    def __len__(self):
+        return self.count
+
+    def get(self, chat_id):
+        row = self.conn.execute(self._select, (chat_id,)).fetchone()
+        if row is None:
+            return None
+        if time.time() - row[0] > self.ttl:
+            self.delete(chat_id)
+            self.expirations += 1
+            return None
+        session = Session(chat_id)
+        for field, value in zip(SESSION_FIELDS, row[1:]):
+            setattr(session, field, value)
+        if session.bundle is not None:
+            parts, share_parts, share_url = json.loads(session.bundle)
+            session.bundle = MessageBundle(tuple(parts), tuple(share_parts), share_url)
+        return session
+
+    def get_or_create(self, chat_id):
+        session = self.get(chat_id)
+        if session is None:
+            session = Session(chat_id)
+            self.save(session)
+        return session
+
+    def save(self, session):
+        now = time.time()
+        values = [getattr(session, field) for field in SESSION_FIELDS]
+        if session.bundle is not None:
+            # Отрендеренный прогноз хранится в базе вместе с ним и виден всем обработчикам
+            values[SESSION_FIELDS.index("bundle")] = json.dumps(session.bundle, ensure_ascii=False)
+        self.conn.execute(self._upsert, (now, *values))
+        self.saves += 1
+        if self.saves % SESSION_SWEEP_EVERY == 0:
+            cursor = self.conn.execute("DELETE FROM sessions WHERE touched < ?", (now - self.ttl,))
+            self.expirations += cursor.rowcount
+        if time.monotonic() - self._counted_at >= SESSION_COUNT_INTERVAL:
+            self._count()
+
+    def delete(self, chat_id):
+        self.conn.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,))
+
+    def stats(self):
+        return {"sessions": len(self), "saves": self.saves, "expirations": self.expirations}
+
+# Асинхронный доступ к хранилищу для хендлеров. Хранилище в памяти вызывается напрямую,
+# SQLite — в единственном отдельном потоке, чтобы ожидание блокировки базы не останавливало цикл событий.
+class AsyncSessions:
+    def __init__(self, store, threaded=False):
+        self.store = store
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="sessions") if threaded else None
+
+    async def _call(self, method, *args):
+        if self._executor is None:
+            return method(*args)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, method, *args)
+
+    async def get(self, chat_id):
+        return await self._call(self.store.get, chat_id)
+
+    async def get_or_create(self, chat_id):
+        return await self._call(self.store.get_or_create, chat_id)
+
+    async def save(self, session):
+        await self._call(self.store.save, session)
+
+    async def delete(self, chat_id):
+        await self._call(self.store.delete, chat_id)
+
+    def __len__(self):
+        return len(self.store)
+
+    def stats(self):
+        return self.store.stats()
+
+if SESSION_BACKEND == "sqlite":
+    sessions = AsyncSessions(SqliteSessionStore(), threaded=True)
+else:
+    sessions = AsyncSessions(SessionStore())
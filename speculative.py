@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import os
+import time
+
+from gpt import generate_prediction
+from scheduler import PRIORITY_PAID, llm_scheduler
+
+# Начинать генерацию "3 событий" заранее, пока пользователь оплачивает счёт
+SPECULATIVE_PREGEN = os.getenv("SPECULATIVE_PREGEN", "0") == "1"
+# Сколько хранить заготовку, если оплата так и не пришла (сек)
+SPECULATIVE_TTL = float(os.getenv("SPECULATIVE_TTL", "600"))
+# Сколько заготовок может генерироваться одновременно
+MAX_SPECULATIVE = int(os.getenv("MAX_SPECULATIVE", "10"))
+
+class SpeculativeEntry:
+    __slots__ = ("key", "task", "created", "tokens", "expiry")
+
+    def __init__(self, key, task):
+        self.key = key
+        self.task = task
+        self.created = time.monotonic()
+        self.tokens = 0
+        self.expiry = None
+
+# Заготовки продолжения (future_mode) по чатам: одна на чат, живёт SPECULATIVE_TTL
+class SpeculativeBuffer:
+    def __init__(self, enabled=SPECULATIVE_PREGEN, ttl=SPECULATIVE_TTL, limit=MAX_SPECULATIVE):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.limit = limit
+        self._entries = {}
+        self.started = 0
+        self.skipped = 0
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+        self.wasted_tokens = 0
+
+    def running(self):
+        return sum(1 for entry in self._entries.values() if not entry.task.done())
+
+    def start(self, chat_id, user_input, previous_response):
+        if not self.enabled or not user_input:
+            return
+        key = (user_input, previous_response)
+        entry = self._entries.get(chat_id)
+        if entry is not None and entry.key == key:
+            return
+        # Заготовки не должны отнимать место у живых запросов: при очереди к OpenAI их не начинаем
+        if self.running() >= self.limit or llm_scheduler.queue_depth():
+            self.skipped += 1
+            return
+        self._drop(chat_id)
+
+        def on_usage(usage):
+            entry.tokens = (usage.prompt_tokens or 0) + (usage.completion_tokens or 0) if usage else 0
+
+        task = asyncio.create_task(generate_prediction(
+            user_input, future_mode=True, previous_response=previous_response,
+            priority=PRIORITY_PAID, on_usage=on_usage
+        ))
+        # Ошибку заготовки заберёт take(); если заготовка не понадобится, она не должна попасть в лог asyncio
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        entry = self._entries[chat_id] = SpeculativeEntry(key, task)
+        entry.expiry = asyncio.get_running_loop().call_later(self.ttl, self._drop, chat_id, entry)
+        self.started += 1
+        logging.info("Начата заранее генерация 3 событий для chat_id %s", chat_id)
+
+    # Результат заготовки после оплаты; None — заготовки нет или она не удалась
+    async def take(self, chat_id, user_input, previous_response):
+        if not self.enabled:
+            return None
+        entry = self._entries.get(chat_id)
+        if entry is None or entry.key != (user_input, previous_response):
+            self.misses += 1
+            return None
+        del self._entries[chat_id]
+        entry.expiry.cancel()
+        try:
+            result = await entry.task
+        except Exception as e:
+            logging.warning("Заготовка 3 событий для chat_id %s не удалась: %s", chat_id, e)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    # Неиспользованная заготовка: отменяем генерацию или списываем потраченные токены
+    def _drop(self, chat_id, entry=None):
+        current = self._entries.get(chat_id)
+        if current is None or (entry is not None and current is not entry):
+            return
+        del self._entries[chat_id]
+        current.expiry.cancel()
+        if current.task.done():
+            self.wasted_tokens += current.tokens
+        else:
+            current.task.cancel()
+            self.cancelled += 1
+
+    def stats(self):
+        taken = self.hits + self.misses
+        return {
+            "started": self.started,
+            "skipped": self.skipped,
+            "running": self.running(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / taken if taken else 0.0,
+            "cancelled": self.cancelled,
+            "wasted_tokens": self.wasted_tokens,
+        }
+
+speculative = SpeculativeBuffer()
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+
+from aiohttp import web
+
+# Публичный адрес бота, на который Telegram будет слать обновления
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Число процессов-обработчиков
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", str(os.cpu_count() or 1)))
+# Сколько раз перезапускать упавший обработчик; после этого вебхук останавливается целиком
+WEBHOOK_WORKER_RESTARTS = int(os.getenv("WEBHOOK_WORKER_RESTARTS", "5"))
+# Как часто проверять, живы ли обработчики (сек)
+WORKER_CHECK_INTERVAL = 1.0
+
+UPDATE_CHAT_FIELDS = (
+    "message", "edited_message", "callback_query", "pre_checkout_query",
+    "shipping_query", "inline_query", "my_chat_member", "chat_member",
+)
+
+# chat_id обновления: по нему выбирается процесс, чтобы обновления одного чата шли по порядку
+def chat_id_of(update):
+    for field in UPDATE_CHAT_FIELDS:
+        event = update.get(field)
+        if not event:
+            continue
+        if "chat" in event:
+            return event["chat"]["id"]
+        if "message" in event and event["message"]:
+            return event["message"]["chat"]["id"]
+        if "from" in event:
+            return event["from"]["id"]
+    return update.get("update_id", 0)
+
+# Процесс-обработчик: получает обновления из своей очереди и передаёт их диспетчеру
+def run_worker(index, updates):
+    # При запуске через "python main.py" модуль бота уже загружен в дочернем процессе как __main__
+    bot_module = sys.modules.get("__main__")
+    if not hasattr(bot_module, "dp"):
+        import main as bot_module
+    asyncio.run(_worker_loop(bot_module, index, updates))
+
+async def _worker_loop(main, index, updates):
+    loop = asyncio.get_running_loop()
+    tails = {}  # {chat_id: задача последнего обновления чата}
+
+    async def process(chat_id, previous, update):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await main.dp.feed_raw_update(main.bot, update)
+        finally:
+            if tails.get(chat_id) is asyncio.current_task():
+                del tails[chat_id]
+
+    # У каждого процесса свой порт метрик: METRICS_PORT + номер обработчика
+    import metrics
+    if metrics.METRICS_PORT:
+        metrics.METRICS_PORT += index
+    await main.on_startup()
+    logging.info("Обработчик вебхука %d запущен (pid %d)", index, os.getpid())
+    try:
+        while True:
+            raw = await loop.run_in_executor(None, updates.get)
+            if raw is None:
+                break
+            update = json.loads(raw)
+            chat_id = chat_id_of(update)
+            tails[chat_id] = asyncio.create_task(process(chat_id, tails.get(chat_id), update))
+        if tails:
+            await asyncio.wait(list(tails.values()))
+    finally:
+        await main.on_shutdown()
+        await main.bot.session.close()
+
+async def _handle_update(request):
+    if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+        return web.Response(status=403)
+    raw = await request.read()
+    try:
+        chat_id = chat_id_of(json.loads(raw))
+    except (ValueError, KeyError, TypeError):
+        return web.Response(status=400)
+    queues = request.app["queues"]
+    queues[chat_id % len(queues)].put(raw)
+    return web.Response()
+
+# Принимающий процесс: слушает один порт и раскладывает обновления по обработчикам по chat_id
+async def serve(bot, workers=WEBHOOK_WORKERS):
+    if workers > 1:
+        # Состояние чатов и аналитика должны быть видны всем процессам
+        os.environ["SESSION_BACKEND"] = "sqlite"
+        if os.getenv("ANALYTICS_BACKEND", "csv") != "sqlite":
+            logging.warning("Несколько обработчиков вебхука: аналитика переключена на SQLite")
+            os.environ["ANALYTICS_BACKEND"] = "sqlite"
+
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue() for _ in range(workers)]
+
+    def start_worker(index):
+        process = context.Process(target=run_worker, args=(index, queues[index]), name=f"webhook-worker-{index}")
+        process.start()
+        return process
+
+    processes = [start_worker(index) for index in range(workers)]
+
+    app = web.Application()
+    app["queues"] = queues
+    app.router.add_post(WEBHOOK_PATH, _handle_update)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    if WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None)
+    logging.info("Вебхук слушает %s:%d%s, обработчиков: %d", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, workers)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    # Упавший обработчик перезапускается с той же очередью: его чаты не теряются молча.
+    # Если он падает снова и снова (например, on_startup не проходит), останавливается весь вебхук.
+    async def supervise():
+        restarts = [0] * workers
+        while not stop.is_set():
+            await asyncio.sleep(WORKER_CHECK_INTERVAL)
+            for index, process in enumerate(processes):
+                if process.is_alive() or stop.is_set():
+                    continue
+                if restarts[index] >= WEBHOOK_WORKER_RESTARTS:
+                    logging.error("Обработчик вебхука %d упал уже %d раз, останавливаем вебхук", index, restarts[index] + 1)
+                    stop.set()
+                    return index
+                restarts[index] += 1
+                logging.error("Обработчик вебхука %d завершился с кодом %s, перезапуск %d из %d",
+                              index, process.exitcode, restarts[index], WEBHOOK_WORKER_RESTARTS)
+                processes[index] = start_worker(index)
+
+    supervisor = asyncio.create_task(supervise())
+    try:
+        await stop.wait()
+    finally:
+        supervisor.cancel()
+        await runner.cleanup()
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            await loop.run_in_executor(None, process.join)
+    # Ненулевой код выхода, чтобы менеджер процессов заметил остановку и перезапустил бота
+    if supervisor.done() and not supervisor.cancelled() and supervisor.result() is not None:
+        raise RuntimeError(f"обработчик вебхука {supervisor.result()} не удаётся запустить")